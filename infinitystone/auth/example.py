@@ -31,6 +31,9 @@ from luxon.exceptions import AccessDeniedError
 
 
 class Example(object):
+    # Authenticates local accounts.
+    local = True
+
     def password(self, username, domain, credentials):
         try:
             password = credentials['password']
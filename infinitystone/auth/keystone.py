@@ -27,23 +27,117 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import hmac
+import threading
+from hashlib import sha256
+from datetime import datetime, timezone
+
 from luxon import g
-from psychokinetic.openstack import Openstack
+from luxon.exceptions import AccessDeniedError
 
+from infinitystone.helpers.cache import Memory
+from infinitystone.helpers.breaker import CircuitBreaker
+from infinitystone.helpers.keystone import KeystoneClient
+
+_client = None
+_client_lock = threading.Lock()
+_breaker = None
+_tokens = None
+_tokens_salt = os.urandom(32)
+
+
+def keystone_client():
+    """Return process wide Keystone client.
+
+    Created lazily on first use in each process, with up to 'keystone_pool'
+    persistent connections and 'keystone_connect_timeout' and
+    'keystone_read_timeout' configured in the '[auth]' section.
+    """
+    global _client
+
+    with _client_lock:
+        if _client is None or _client[0] != os.getpid():
+            keystone_url = g.app.config.get('auth', 'keystone_url')
+            pool_size = g.app.config.getint('auth', 'keystone_pool',
+                                            fallback=10)
+            timeout = (g.app.config.getfloat('auth',
+                                             'keystone_connect_timeout',
+                                             fallback=2),
+                       g.app.config.getfloat('auth',
+                                             'keystone_read_timeout',
+                                             fallback=8),)
+            _client = (os.getpid(),
+                       KeystoneClient(keystone_url, pool_size, timeout),)
+
+        return _client[1]
+
+
+def keystone_breaker():
+    """Return process wide circuit breaker for Keystone.
+
+    Opens after 'keystone_breaker_threshold' consecutive upstream failures
+    for 'keystone_breaker_reset' seconds, configured in the '[auth]'
+    section. Invalid credentials are not upstream failures.
+    """
+    global _breaker
+
+    with _client_lock:
+        if _breaker is None:
+            threshold = g.app.config.getint('auth',
+                                            'keystone_breaker_threshold',
+                                            fallback=5)
+            reset = g.app.config.getfloat('auth',
+                                          'keystone_breaker_reset',
+                                          fallback=30)
+            _breaker = CircuitBreaker('keystone', threshold, reset,
+                                      exclude=(AccessDeniedError,))
+
+        return _breaker
 
-class Keystone(object):
-    def password(self, username, domain, credentials):
 
-        keystone_url = g.app.config.get('auth', 'keystone_url')
-        region = g.app.config.get('auth',
-                                  'openstack_region',
-                                  fallback='RegionOne')
+def token_cache():
+    """Return process wide unscoped token cache.
 
+    Sized by 'keystone_token_cache' in the '[auth]' section, least recently
+    used tokens are evicted first. Returns None when size is 0, the
+    default.
+    """
+    global _tokens
+
+    with _client_lock:
+        if _tokens is None:
+            size = g.app.config.getint('auth', 'keystone_token_cache',
+                                       fallback=0)
+            _tokens = Memory(size) if size > 0 else False
+
+        return _tokens or None
+
+
+def _token_key(username, domain, password):
+    credentials = '%s\0%s\0%s' % (username, domain, password,)
+    return hmac.new(_tokens_salt, credentials.encode('utf-8'),
+                    sha256).hexdigest()
+
+
+def _expires_in(expire):
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ',):
+        try:
+            expire = datetime.strptime(expire, fmt)
+        except (TypeError, ValueError):
+            continue
+        expire = expire.replace(tzinfo=timezone.utc)
+        return (expire - datetime.now(timezone.utc)).total_seconds()
+
+    return 0
+
+
+class Keystone(object):
+    def password(self, username, domain, credentials):
         if not domain:
             domain = g.app.config.get('auth',
                                       'openstack_domain', fallback='default')
 
-        os = Openstack(keystone_url=keystone_url, region=region)
         try:
             password = credentials['password']
         except KeyError:
@@ -52,9 +146,29 @@ class Keystone(object):
         if not domain:
             raise ValueError("No 'domain' provided")
 
-        response = os.identity.authenticate(username, password, domain).json
+        tokens = token_cache()
+        if tokens is not None:
+            key = _token_key(username, domain, password)
+            cached = tokens.load(key)
+            if cached:
+                token, expire = cached
+                return {
+                    'os_unscoped_token': token,
+                    'os_token_expire': expire,
+                }
+
+        token, expire = keystone_breaker().call(
+            keystone_client().authenticate, username, password, domain)
+
+        if tokens is not None:
+            # Reuse token until shortly before Keystone expires it.
+            margin = g.app.config.getint('auth', 'keystone_token_margin',
+                                         fallback=300)
+            ttl = _expires_in(expire) - margin
+            if ttl > 0:
+                tokens.store(key, (token, expire,), ttl)
 
         return {
-            'os_unscoped_token': os._login_token,
-            'os_token_expire': response['token']['expires_at'],
+            'os_unscoped_token': token,
+            'os_token_expire': expire,
         }
@@ -28,14 +28,22 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
 from infinitystone.helpers.auth import authorize
+from infinitystone.helpers.password import verify_pool
 
 
 class SQL(object):
+    # Authenticates local accounts.
+    local = True
+
     def password(self, username, domain, credentials):
         try:
             password = credentials['password']
         except KeyError:
             raise ValueError("No 'password' provided in 'credentials'")
 
-        authorize(username, password, domain)
+        pool = verify_pool()
+        if pool:
+            authorize(username, password, domain, valid=pool.valid)
+        else:
+            authorize(username, password, domain)
         return {}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+from luxon import g
+
+from infinitystone.helpers.cache import (cache_store,
+                                         cache_load,
+                                         get_generation)
+from infinitystone.helpers.roles import get_user_roles, get_all_roles
+
+
+class EffectiveAccess(object):
+    """Effective access of user.
+
+    Role assignments of user indexed by global, domain and tenant context
+    with set semantics.
+
+    Args:
+        assignments (list): Tuples of role, domain and tenant_id.
+    """
+    def __init__(self, assignments):
+        self.global_roles = set()
+        self.domain_roles = {}
+        self.tenant_roles = {}
+
+        for role, domain, tenant_id in assignments:
+            if tenant_id is not None:
+                self.tenant_roles.setdefault((domain, tenant_id),
+                                             set()).add(role)
+            elif domain is not None:
+                self.domain_roles.setdefault(domain, set()).add(role)
+            else:
+                self.global_roles.add(role)
+
+    @property
+    def domains(self):
+        """Names of domains with role assignments of user."""
+        domains = set(self.domain_roles)
+        domains |= {domain for domain, tenant_id in self.tenant_roles}
+        domains.discard(None)
+        return sorted(domains)
+
+    def roles(self, domain=None, tenants=()):
+        """Return roles assignable by user in context.
+
+        Args:
+            domain (str): Domain of context.
+            tenants (list): Tenant of context and its parent tenants.
+        """
+        roles = set(self.global_roles)
+        roles |= self.domain_roles.get(domain, set())
+        for tenant_id in tenants:
+            roles |= self.tenant_roles.get((domain, tenant_id), set())
+
+        if 'Root' in roles:
+            return get_all_roles()
+
+        return sorted(roles)
+
+
+def get_effective_access(user_id):
+    """Return effective access of user.
+
+    Role assignments are cached for 'access_cache_expire' seconds in the
+    '[auth]' section, until roles or role assignments of the user change.
+    """
+    expire = g.app.config.getint('auth', 'access_cache_expire',
+                                 fallback=600)
+    key = 'access:%s:%s:%s' % (user_id,
+                               get_generation('user_roles:%s' % user_id),
+                               get_generation('roles'),)
+
+    assignments = cache_load(key) if expire > 0 else None
+    if assignments is None:
+        assignments = [(role['role'], role['domain'], role['tenant_id'],)
+                       for role in get_user_roles(user_id)]
+        if expire > 0:
+            cache_store(key, assignments, expire)
+
+    return EffectiveAccess(assignments)
@@ -27,91 +27,216 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
+from uuid import uuid4
+
 from luxon import g
 from luxon import db
+from luxon import js
 from luxon.exceptions import HTTPForbidden
 from luxon.utils.password import valid as is_valid_password
+from luxon.utils.timezone import now
 from luxon.exceptions import AccessDeniedError
-from infinitystone.models.users import infinitystone_user
+from infinitystone.helpers.cache import Memory, get_generation
+from infinitystone.helpers.password import needs_rehash, rehash
+from infinitystone.helpers.sql import ignore_conflict
 
+# Users localized in this process.
+_localized = Memory(10000)
 
-def user_tenant(user_id, role):
-    tenants = []
 
-    with db() as conn:
-        query = "SELECT" + \
-                " infinitystone_user_role.tenant_id as tenant_id" + \
-                " FROM" + \
-                " infinitystone_user_role LEFT JOIN infinitystone_role ON" + \
-                " infinitystone_user_role.role_id = infinitystone_role.id" + \
-                " WHERE infinitystone_user_role.user_id = %s" + \
-                " AND infinitystone_role.name = %s" + \
-                " AND infinitystone_user_role.tenant_id is not NULL"
-        result = conn.execute(query, (user_id, role,)).fetchall()
+class AccountDeniedError(AccessDeniedError):
+    """Credentials denied for existing local account.
+
+    Unlike other denials, no further authentication drivers are tried.
+    """
+
+
+def _select_local(conn, username, domain):
+    values = [username, ]
+    sql = 'SELECT id, roaming, region, confederation FROM infinitystone_user'
+    sql += ' WHERE'
+    sql += ' username = %s'
+    if domain is not None:
+        sql += ' AND domain = %s'
+        values.append(domain)
+    else:
+        sql += ' AND domain IS NULL'
+    return conn.execute(sql,
+                        values).fetchone()
+
+
+def _insert_roaming(conn, username, domain, region, confederation):
+    # Single statement upsert, concurrent first logins of the same user
+    # leave the row inserted first.
+    sql = 'INSERT INTO infinitystone_user'
+    sql += ' (id, username, domain, region, confederation,'
+    sql += ' roaming, enabled, creation_time)'
+    sql += ' VALUES (%s, %s, %s, %s, %s, 1, 1, %s)'
+    sql += ignore_conflict()
+    conn.execute(sql, (str(uuid4()), username, domain, region or None,
+                       confederation or None,
+                       now().strftime('%Y-%m-%d %H:%M:%S'),))
+    conn.commit()
+
+
+def _localize(conn, username, domain, region=None, confederation=None,
+              user_id=None, local=True):
+    memo = js.dumps([username, domain, region, confederation, user_id,
+                     local])
+    localized = _localized.load(memo)
+    if localized:
+        # Users changed or deleted by any worker are looked up again.
+        user_id_memo, generation = localized
+        if generation == get_generation('user:%s' % user_id_memo):
+            return user_id_memo
+
+    result = _select_local(conn, username, domain)
 
-    for tenant in result:
-        tenants.append(tenant['tenant_id'])
+    if not result:
+        _insert_roaming(conn, username, domain, region, confederation)
+        result = _select_local(conn, username, domain)
+        if not result:
+            raise HTTPForbidden('Username exists in context already.')
 
-    return tenants
+    if (result['roaming'] == 1):
+        if (result['region'] and region and
+                result['region'] != region):
+            raise HTTPForbidden('Username exists in context already.')
+        if (result['confederation'] and confederation and
+                result['confederation'] != confederation):
+            raise HTTPForbidden('Username exists in context already.')
+    elif not local:
+        # Only local drivers authenticate local accounts.
+        raise AccountDeniedError('Local username exists for roaming user.')
+    else:
+        local_region = g.app.config.get(
+                        'auth',
+                        'region',
+                        fallback='Region1')
+        local_confed = g.app.config.get(
+                        'auth',
+                        'confederation',
+                        fallback='Confederation1')
+        if ((region and region != local_region) or
+                (confederation and
+                 confederation != local_confed)):
+            if (user_id != result['id']):
+                raise HTTPForbidden(
+                    'Local username exists for roaming user.')
+
+    _localized.store(memo,
+                     (result['id'],
+                      get_generation('user:%s' % result['id']),),
+                     g.app.config.getint('auth', 'localize_expire',
+                                         fallback=300))
+    return result['id']
+
+
+def forget_localized():
+    """Clear memo of localized users in this process."""
+    _localized.clear()
+
+
+def is_local(region, confederation):
+    """Return True if region and confederation are this service's own.
+
+    Users with tokens issued locally have been localized when logging in.
+    """
+    return (region == g.app.config.get('auth',
+                                       'region',
+                                       fallback='Region1') and
+            confederation == g.app.config.get('auth',
+                                              'confederation',
+                                              fallback='Confederation1'))
 
 
 def localize(username, domain, region=None, confederation=None, user_id=None):
     with db() as conn:
-        values = [username, ]
-        sql = 'SELECT * FROM infinitystone_user'
-        sql += ' WHERE'
-        sql += ' username = %s'
-        if domain is not None:
-            sql += ' AND domain = %s'
-            values.append(domain)
-        else:
-            sql += ' AND domain IS NULL'
-        result = conn.execute(sql,
-                              values).fetchone()
-
-        if result:
-            if (result['roaming'] == 1):
-                if (result['region'] and region and
-                        result['region'] != region):
-                    raise HTTPForbidden('Username exists in context already.')
-                if (result['confederation'] and confederation and
-                        result['confederation'] != confederation):
-                    raise HTTPForbidden('Username exists in context already.')
-            else:
-                local_region = g.app.config.get(
-                                'auth',
-                                'region',
-                                fallback='Region1'),
-                local_confed = g.app.config.get(
-                                'auth',
-                                'confederation',
-                                fallback='Confederation1')
-                if ((region and region != local_region) or
-                        (confederation and
-                         confederation != local_confed)):
-                    if (user_id != result['id']):
-                        raise HTTPForbidden(
-                            'Local username exists for roaming user.')
-        elif not result:
-            user_obj = infinitystone_user()
-            user_obj['username'] = username
-            if domain:
-                user_obj['domain'] = domain
-            if region:
-                user_obj['region'] = region
-            if confederation:
-                user_obj['confederation'] = confederation
-            user_obj['roaming'] = True
-
-            user_obj.commit()
-
-
-def authorize(username=None, password=None, domain=None):
+        return _localize(conn, username, domain, region,
+                         confederation, user_id)
+
+
+def login_context(username, domain, region=None, confederation=None,
+                  local=True):
+    """Resolve login context for user.
+
+    Localizes the user and collects global roles, domain roles and
+    'Customer' tenant candidates using a single connection. Users
+    authenticated by drivers that are not local may not resolve to a
+    local account.
+
+    For each tenant in 'customer_tenants', 'tenant_domains' and
+    'tenant_roles' provide the tenant's domain and the roles assigned to
+    the user on the tenant.
+    """
+    context = {'global_roles': [],
+               'domain_roles': [],
+               'customer_tenants': [],
+               'tenant_domains': {},
+               'tenant_roles': {}}
+
+    with db() as conn:
+        user_id = _localize(conn, username, domain, region, confederation,
+                            local=local)
+        context['user_id'] = user_id
+
+        # Global and domain assignments, as well as all assignments on
+        # tenants where user is 'Customer'.
+        query = 'SELECT' + \
+                ' infinitystone_role.name AS role,' + \
+                ' infinitystone_user_role.domain AS domain,' + \
+                ' infinitystone_user_role.tenant_id AS tenant_id,' + \
+                ' infinitystone_tenant.domain AS tenant_domain' + \
+                ' FROM' + \
+                ' infinitystone_user_role LEFT JOIN infinitystone_role ON' + \
+                ' infinitystone_user_role.role_id = infinitystone_role.id' + \
+                ' LEFT JOIN infinitystone_tenant ON' + \
+                ' infinitystone_user_role.tenant_id =' + \
+                ' infinitystone_tenant.id' + \
+                ' WHERE infinitystone_user_role.user_id = %s' + \
+                ' AND ((infinitystone_user_role.tenant_id IS NULL' + \
+                ' AND (infinitystone_user_role.domain IS NULL' + \
+                ' OR infinitystone_user_role.domain = %s))' + \
+                ' OR infinitystone_user_role.tenant_id IN' + \
+                ' (SELECT customer_role.tenant_id' + \
+                ' FROM infinitystone_user_role customer_role' + \
+                ' INNER JOIN infinitystone_role customer ON' + \
+                ' customer_role.role_id = customer.id' + \
+                ' WHERE customer_role.user_id = %s' + \
+                " AND customer.name = 'Customer'" + \
+                ' AND customer_role.tenant_id IS NOT NULL))'
+        result = conn.execute(query, (user_id, domain, user_id,)).fetchall()
+
+    for assignment in result:
+        if assignment['tenant_id'] is None:
+            if assignment['domain'] is None:
+                context['global_roles'].append(assignment['role'])
+            if assignment['domain'] == domain:
+                context['domain_roles'].append(assignment['role'])
+        elif assignment['role'] == 'Customer':
+            context['customer_tenants'].append(assignment['tenant_id'])
+
+    for tenant_id in context['customer_tenants']:
+        context['tenant_domains'][tenant_id] = None
+        context['tenant_roles'][tenant_id] = []
+
+    for assignment in result:
+        tenant_id = assignment['tenant_id']
+        if tenant_id in context['tenant_roles']:
+            context['tenant_domains'][tenant_id] = assignment['tenant_domain']
+            if assignment['domain'] == assignment['tenant_domain']:
+                context['tenant_roles'][tenant_id].append(assignment['role'])
+
+    return context
+
+
+def authorize(username=None, password=None, domain=None,
+              valid=is_valid_password):
     with db() as conn:
         values = [username, ]
-        sql = 'SELECT username, password FROM infinitystone_user'
+        sql = 'SELECT id, username, password, enabled FROM infinitystone_user'
         sql += ' WHERE'
-        sql += ' username = %s AND enabled = 1'
+        sql += ' username = %s'
         sql += ' AND roaming = 0'
         if domain is not None:
             sql += ' AND domain = %s'
@@ -121,9 +246,15 @@ def authorize(username=None, password=None, domain=None):
 
         crsr = conn.execute(sql, values)
         result = crsr.fetchone()
-        if result is not None:
-            # Validate Password againts stored HASHED Value.
-            if is_valid_password(password, result['password']):
-                return True
 
+    if result is None:
+        # No local account, other drivers may authenticate user.
         raise AccessDeniedError('Invalid credentials provided')
+
+    # Validate Password againts stored HASHED Value.
+    if result['enabled'] and valid(password, result['password']):
+        if needs_rehash(result['password']):
+            rehash(result['id'], password, result['password'])
+        return True
+
+    raise AccountDeniedError('Invalid credentials provided')
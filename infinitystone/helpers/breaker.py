@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import threading
+from time import monotonic
+
+from luxon import constants as const
+from luxon import GetLogger
+from luxon.exceptions import HTTPError
+
+log = GetLogger(__name__)
+
+_breakers = {}
+
+
+class CircuitBreaker(object):
+    """Circuit breaker for calls to upstream services.
+
+    Opens after 'threshold' consecutive failures, failing calls fast with
+    '503 Service Unavailable' for 'reset' seconds. Thereafter a single probe
+    call is let through (half-open), closing the circuit on success.
+
+    Args:
+        name (str): Name of upstream service for monitoring.
+        threshold (int): Consecutive failures before opening.
+        reset (float): Seconds before probing upstream again.
+        exclude (tuple): Exceptions not counted as failures.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=5, reset=30, exclude=()):
+        self.name = name
+        self._threshold = threshold
+        self._reset = reset
+        self._exclude = exclude
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._rejected = 0
+        _breakers[name] = self
+
+    @property
+    def state(self):
+        return self._state
+
+    def _acquire(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                if monotonic() - self._opened >= self._reset:
+                    self._state = self.HALF_OPEN
+                    self._probing = True
+                    return
+
+            elif self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+
+            elif self._state == self.CLOSED:
+                return
+
+            self._rejected += 1
+
+        raise HTTPError(const.HTTP_503,
+                        "Upstream '%s' unavailable" % self.name)
+
+    def _success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def _failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if (self._state == self.HALF_OPEN or
+                    self._failures >= self._threshold):
+                if self._state != self.OPEN:
+                    log.warning("Circuit for upstream '%s' opened" %
+                                self.name)
+                self._state = self.OPEN
+                self._opened = monotonic()
+
+    def call(self, func, *args, **kwargs):
+        self._acquire()
+        try:
+            result = func(*args, **kwargs)
+        except self._exclude:
+            self._success()
+            raise
+        except Exception:
+            self._failure()
+            raise
+
+        self._success()
+        return result
+
+    def status(self):
+        with self._lock:
+            return {'name': self.name,
+                    'state': self._state,
+                    'failures': self._failures,
+                    'rejected': self._rejected,
+                    'threshold': self._threshold,
+                    'reset': self._reset}
+
+
+def breakers():
+    """Return status of circuit breakers in this process."""
+    return [breaker.status() for breaker in _breakers.values()]
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import threading
+from uuid import uuid4
+from time import monotonic
+from collections import OrderedDict
+
+from luxon import g
+from luxon import js
+from luxon import GetLogger
+from luxon.utils.imports import get_class
+
+log = GetLogger(__name__)
+
+PREFIX = 'infinitystone:'
+GENERATION_EXPIRE = 86400
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class Memory(object):
+    """Bounded in-process cache with expiry.
+
+    Least recently used entries are evicted once 'max_objects' is reached.
+    """
+    def __init__(self, max_objects=5000):
+        self._max_objects = max_objects
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def store(self, key, value, expire):
+        with self._lock:
+            self._objects[key] = (value, monotonic() + expire,)
+            self._objects.move_to_end(key)
+            while len(self._objects) > self._max_objects:
+                self._objects.popitem(last=False)
+
+    def load(self, key):
+        with self._lock:
+            try:
+                value, expire = self._objects[key]
+            except KeyError:
+                return None
+
+            if expire < monotonic():
+                del self._objects[key]
+                return None
+
+            self._objects.move_to_end(key)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+_memory = Memory()
+
+
+def _get_backend():
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                try:
+                    backend = g.app.config.get('cache', 'backend')
+                    _backend = get_class(backend)()
+                except Exception as e:
+                    log.warning('Cache backend unavailable,'
+                                ' using process memory (%s)' % e)
+                    _backend = _memory
+
+    return _backend
+
+
+def cache_store(key, value, expire):
+    """Store JSON serializable value in configured cache backend.
+
+    Values are shared between workers through the '[cache]' backend, falls
+    back to process memory when the backend is unavailable.
+
+    Args:
+        key (str): Unique key for value.
+        value (obj): JSON serializable value.
+        expire (int): Seconds before value expires.
+    """
+    try:
+        _get_backend().store(PREFIX + key, js.dumps(value), expire)
+    except Exception as e:
+        log.warning('Cache store failed, using process memory (%s)' % e)
+        _memory.store(PREFIX + key, js.dumps(value), expire)
+
+
+def cache_load(key):
+    """Load value from configured cache backend.
+
+    Returns None when not found or expired.
+    """
+    try:
+        value = _get_backend().load(PREFIX + key)
+    except Exception as e:
+        log.warning('Cache load failed, using process memory (%s)' % e)
+        value = _memory.load(PREFIX + key)
+
+    if value is not None:
+        return js.loads(value)
+
+
+def get_generation(name):
+    """Return current generation of cached data.
+
+    Cache keys including the generation are invalidated across workers by
+    bumping the generation with 'bump_generation'.
+    """
+    generation = cache_load('generation:' + name)
+    if generation is None:
+        generation = bump_generation(name)
+
+    return generation
+
+
+def bump_generation(name):
+    generation = uuid4().hex[:12]
+    cache_store('generation:' + name, generation, GENERATION_EXPIRE)
+    return generation
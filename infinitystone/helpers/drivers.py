@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import threading
+from time import perf_counter
+
+from luxon import g
+from luxon import GetLogger
+from luxon.utils.imports import get_class
+from luxon.exceptions import AccessDeniedError
+
+from infinitystone.helpers.auth import AccountDeniedError
+
+log = GetLogger(__name__)
+
+# Upper bounds of latency histogram buckets in milliseconds.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_drivers = None
+_drivers_lock = threading.Lock()
+
+
+class DriverStats(object):
+    """Call counts and latency histogram of authentication driver."""
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._denied = 0
+        self._failures = 0
+        self._total = 0.0
+        self._histogram = [0] * (len(BUCKETS) + 1)
+
+    def record(self, elapsed, denied=False, failed=False):
+        elapsed *= 1000
+        for bucket, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                break
+        else:
+            bucket = len(BUCKETS)
+
+        with self._lock:
+            self._calls += 1
+            self._total += elapsed
+            self._histogram[bucket] += 1
+            if denied:
+                self._denied += 1
+            if failed:
+                self._failures += 1
+
+    def status(self):
+        with self._lock:
+            histogram = {}
+            for bucket, bound in enumerate(BUCKETS):
+                histogram[str(bound)] = self._histogram[bucket]
+            histogram['inf'] = self._histogram[-1]
+
+            return {'driver': self.name,
+                    'calls': self._calls,
+                    'denied': self._denied,
+                    'failures': self._failures,
+                    'total_ms': round(self._total, 3),
+                    'histogram_ms': histogram}
+
+
+def get_drivers():
+    """Return chain of configured authentication drivers.
+
+    The '[auth]' 'driver' option holds a comma separated list of drivers
+    tried in order. Drivers are instantiated once per process.
+
+    Returns list of tuples with driver and its statistics.
+    """
+    global _drivers
+
+    if _drivers is None:
+        with _drivers_lock:
+            if _drivers is None:
+                drivers = []
+                for name in g.app.config.get('auth', 'driver').split(','):
+                    name = name.strip()
+                    if name:
+                        drivers.append((get_class(name)(),
+                                        DriverStats(name),))
+                _drivers = drivers
+
+    return _drivers
+
+
+def authenticate(method, username, domain, credentials):
+    """Authenticate with first driver in chain accepting credentials.
+
+    Drivers not supporting the method are skipped. Drivers denying the
+    credentials or failing pass on to the next driver, unless a local
+    account was denied or a local driver failed. If any driver denied the
+    credentials access is denied, otherwise the error of the last driver
+    tried is raised.
+
+    Returns tuple of metadata provided by driver and whether the driver
+    authenticates local accounts.
+    """
+    denied = False
+    error = None
+
+    for driver, stats in get_drivers():
+        if not hasattr(driver, method):
+            continue
+
+        start = perf_counter()
+        try:
+            metadata = getattr(driver, method)(username, domain,
+                                               credentials=credentials)
+        except AccountDeniedError:
+            stats.record(perf_counter() - start, denied=True)
+            raise
+        except AccessDeniedError as e:
+            stats.record(perf_counter() - start, denied=True)
+            denied = True
+            error = e
+            continue
+        except Exception as e:
+            stats.record(perf_counter() - start, failed=True)
+            log.warning("Authentication driver '%s' failed (%s)" %
+                        (stats.name, e,))
+            if getattr(driver, 'local', False):
+                # Never pass local credentials on when unable to check them.
+                raise
+            error = e
+            continue
+
+        stats.record(perf_counter() - start)
+        return (metadata, getattr(driver, 'local', False),)
+
+    if denied:
+        raise AccessDeniedError('Invalid credentials provided')
+
+    if error is None:
+        raise ValueError(
+            "'%s' authentication method not supported" % method
+        )
+
+    raise error
+
+
+def driver_stats():
+    """Return statistics of authentication drivers in this process."""
+    return [stats.status() for driver, stats in get_drivers()]
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+from hashlib import sha256
+
+from luxon import g
+from luxon import constants as const
+from luxon.exceptions import HTTPError
+
+from infinitystone.helpers.cache import cache_store, cache_load
+
+
+def _user_key(username, domain):
+    digest = sha256(('%s\0%s' % (username, domain,)).encode('utf-8'))
+    return 'login_failures:user:' + digest.hexdigest()
+
+
+def _addr_key(remote_addr):
+    return 'login_failures:addr:%s' % remote_addr
+
+
+def check_failures(username, domain, remote_addr):
+    """Reject login attempts for offending credentials or addresses.
+
+    Raises '429 Too Many Requests' once failed logins for the username and
+    domain reached 'login_failures', or for the client address reached
+    'login_failures_addr' within 'login_failure_window' seconds. Limits
+    are configured in the '[auth]' section, 0 disables the limit.
+
+    Returns number of failed logins recorded for username and domain.
+    """
+    user_limit = g.app.config.getint('auth', 'login_failures',
+                                     fallback=0)
+    addr_limit = g.app.config.getint('auth', 'login_failures_addr',
+                                     fallback=0)
+
+    failures = 0
+    if user_limit > 0:
+        failures = cache_load(_user_key(username, domain)) or 0
+        if failures >= user_limit:
+            raise HTTPError(const.HTTP_429,
+                            'Too many failed login attempts')
+
+    if addr_limit > 0 and remote_addr:
+        if (cache_load(_addr_key(remote_addr)) or 0) >= addr_limit:
+            raise HTTPError(const.HTTP_429,
+                            'Too many failed login attempts')
+
+    return failures
+
+
+def record_failure(username, domain, remote_addr):
+    window = g.app.config.getint('auth', 'login_failure_window',
+                                 fallback=300)
+
+    keys = []
+    if g.app.config.getint('auth', 'login_failures', fallback=0) > 0:
+        keys.append(_user_key(username, domain))
+    if (g.app.config.getint('auth', 'login_failures_addr', fallback=0) > 0
+            and remote_addr):
+        keys.append(_addr_key(remote_addr))
+
+    for key in keys:
+        cache_store(key, (cache_load(key) or 0) + 1, window)
+
+
+def clear_failures(username, domain):
+    cache_store(_user_key(username, domain), 0, 1)
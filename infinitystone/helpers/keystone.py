@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import requests
+from requests.adapters import HTTPAdapter
+
+from luxon import js
+from luxon.exceptions import AccessDeniedError
+
+
+class KeystoneClient(object):
+    """Keystone v3 identity client with persistent connections.
+
+    Up to 'pool_size' keep-alive connections to Keystone are kept open and
+    shared by all threads, avoiding a new TCP/TLS handshake per login.
+
+    Args:
+        keystone_url (str): Keystone v3 URL, ie. 'http://example:5000/v3'.
+        pool_size (int): Maximum connections kept to Keystone.
+        timeout (tuple): Connect and read timeouts in seconds.
+    """
+    def __init__(self, keystone_url, pool_size=10, timeout=(2, 8,)):
+        self.keystone_url = keystone_url.rstrip('/')
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              pool_block=True)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def authenticate(self, username, password, domain):
+        """Authenticate user and return unscoped token.
+
+        Returns tuple of token and expiry as provided by Keystone.
+        """
+        auth = {'auth': {
+            'identity': {
+                'methods': ['password'],
+                'password': {
+                    'user': {
+                        'name': username,
+                        'domain': {'name': domain},
+                        'password': password
+                    }
+                }
+            }
+        }}
+        response = self._session.post(
+            self.keystone_url + '/auth/tokens',
+            data=js.dumps(auth),
+            headers={'Content-Type': 'application/json'},
+            timeout=self._timeout)
+
+        if response.status_code == 401:
+            raise AccessDeniedError('Invalid credentials provided')
+        response.raise_for_status()
+
+        return (response.headers['X-Subject-Token'],
+                js.loads(response.content)['token']['expires_at'],)
+
+    def close(self):
+        self._session.close()
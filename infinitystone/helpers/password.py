@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import re
+import multiprocessing
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from luxon import g
+from luxon import db
+from luxon import constants as const
+from luxon import GetLogger
+from luxon.exceptions import HTTPError
+from luxon.utils.password import hash
+from luxon.utils.password import valid as is_valid_password
+
+from infinitystone.helpers.cache import cache_store, cache_load
+
+log = GetLogger(__name__)
+
+BCRYPT_MIN_COST = 4
+BCRYPT_MAX_COST = 31
+BCRYPT_COST = re.compile(r'^\$2[aby]\$(\d{2})\$')
+
+# Hashes timed per cost when calibrating.
+CALIBRATE_SAMPLES = 3
+# Seconds calibrated cost is shared, and rechecked by each process.
+COST_EXPIRE = 2592000
+COST_RECHECK = 60
+
+_pool = None
+_pool_lock = threading.Lock()
+_cost = None
+_cost_lock = threading.Lock()
+_calibrating = False
+_rehash = ThreadPoolExecutor(max_workers=1)
+_rehashing = set()
+_rehashing_lock = threading.Lock()
+
+
+class VerifyPool(object):
+    """Bounded process pool for password hash verification.
+
+    Hash verification is pure CPU, offloading it to a pool of processes
+    allows logins to scale across cores instead of holding up request
+    threads. Verifications waiting beyond the queue limit fail fast with
+    '503 Service Unavailable'.
+
+    Args:
+        workers (int): Number of worker processes.
+        queue (int): Number of verifications allowed to wait for a worker.
+    """
+    def __init__(self, workers, queue=0):
+        self._workers = workers
+        self._limit = workers + queue
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        with self._lock:
+            # Pool is created lazily per process, WSGI servers fork workers
+            # after importing the application.
+            if self._executor is None or self._pid != os.getpid():
+                # Forking threaded WSGI workers may copy held locks.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context('forkserver'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def valid(self, password, hashed):
+        with self._lock:
+            if self._pending >= self._limit:
+                raise HTTPError(const.HTTP_503,
+                                'Password verification queue full')
+            self._pending += 1
+
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(is_valid_password,
+                                       password,
+                                       hashed).result()
+            except BrokenProcessPool:
+                self._reset(executor)
+                raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def verify_pool():
+    """Return process wide password verification pool.
+
+    Configured with 'verify_workers' and 'verify_queue' in the '[auth]'
+    section. Returns None when 'verify_workers' is 0, the default.
+    """
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = g.app.config.getint('auth', 'verify_workers',
+                                              fallback=0)
+                if workers > 0:
+                    queue = g.app.config.getint('auth', 'verify_queue',
+                                                fallback=workers * 4)
+                    _pool = VerifyPool(workers, queue)
+                else:
+                    _pool = False
+
+    return _pool or None
+
+
+def calibrate(budget):
+    """Return largest bcrypt cost hashing within budget.
+
+    Each increment of the cost doubles the hashing time, measurement stops
+    once the next cost would exceed the budget. The fastest of
+    CALIBRATE_SAMPLES hashes is used per cost to reduce noise.
+
+    Args:
+        budget (int): Latency budget in milliseconds.
+    """
+    cost = BCRYPT_MIN_COST
+    while cost < BCRYPT_MAX_COST:
+        elapsed = None
+        for attempt in range(CALIBRATE_SAMPLES):
+            start = time.perf_counter()
+            bcrypt.hashpw(b'calibrate', bcrypt.gensalt(cost))
+            sample = (time.perf_counter() - start) * 1000
+            if elapsed is None or sample < elapsed:
+                elapsed = sample
+        if elapsed * 2 > budget:
+            break
+        cost += 1
+
+    return cost
+
+
+def _calibrate(budget, minimum, key):
+    global _cost, _calibrating
+
+    try:
+        cost = max(calibrate(budget), minimum)
+        cache_store(key, cost, COST_EXPIRE)
+        # Workers calibrating concurrently settle on one cost.
+        cost = cache_load(key) or cost
+        log.info('Password hash cost %s for %sms budget' %
+                 (cost, budget,))
+        with _cost_lock:
+            _cost = (cost, time.monotonic() + COST_RECHECK,)
+        return cost
+    finally:
+        with _cost_lock:
+            _calibrating = False
+
+
+def hash_cost(wait=False):
+    """Return bcrypt cost for password hashes.
+
+    'hash_cost' in the '[auth]' section fixes the cost. Otherwise the
+    first worker calibrates against 'hash_budget_ms', but never lower than
+    'hash_min_cost', and shares the cost with all workers through the
+    cache backend. Returns None when neither is configured, leaving the
+    cost to luxon's default.
+
+    Calibration runs in the background unless wait is set, the last known
+    cost is returned meanwhile, None if there is none.
+
+    Args:
+        wait (bool): Calibrate in calling thread, used at startup.
+    """
+    global _cost, _calibrating
+
+    cost = g.app.config.getint('auth', 'hash_cost', fallback=0)
+    if cost > 0:
+        return cost
+
+    budget = g.app.config.getint('auth', 'hash_budget_ms',
+                                 fallback=0)
+    if budget <= 0:
+        return None
+
+    with _cost_lock:
+        if _cost is not None and _cost[1] > time.monotonic():
+            return _cost[0]
+
+        minimum = g.app.config.getint('auth', 'hash_min_cost',
+                                      fallback=10)
+        key = 'hash_cost:%s:%s' % (budget, minimum,)
+        cost = cache_load(key)
+        if cost is not None:
+            _cost = (cost, time.monotonic() + COST_RECHECK,)
+            return cost
+
+        if _calibrating:
+            return _cost[0] if _cost else None
+        _calibrating = True
+
+    if wait:
+        return _calibrate(budget, minimum, key)
+
+    threading.Thread(target=_calibrate,
+                     args=(budget, minimum, key,),
+                     daemon=True).start()
+
+    return _cost[0] if _cost else None
+
+
+def hash_password(password):
+    cost = hash_cost()
+    if cost:
+        return bcrypt.hashpw(password.encode('utf-8'),
+                             bcrypt.gensalt(cost)).decode('utf-8')
+    else:
+        return hash(password)
+
+
+def get_cost(hashed):
+    match = BCRYPT_COST.match(hashed or '')
+    if match:
+        return int(match.group(1))
+
+
+def needs_rehash(hashed):
+    cost = hash_cost()
+    current = get_cost(hashed)
+    return (cost is not None and current is not None and
+            current != cost)
+
+
+def _update_hash(user_id, password, hashed):
+    try:
+        with db() as conn:
+            # Only replace the hash verified, password may have changed.
+            sql = 'UPDATE infinitystone_user SET password = %s'
+            sql += ' WHERE id = %s AND password = %s'
+            conn.execute(sql, (hash_password(password), user_id, hashed,))
+            conn.commit()
+    except Exception as e:
+        log.error("Failed rehashing password for user '%s' (%s)" %
+                  (user_id, e,))
+    finally:
+        with _rehashing_lock:
+            _rehashing.discard(user_id)
+
+
+def rehash(user_id, password, hashed):
+    """Rehash password with current cost in the background."""
+    with _rehashing_lock:
+        if user_id in _rehashing:
+            return
+        _rehashing.add(user_id)
+
+    _rehash.submit(_update_hash, user_id, password, hashed)
@@ -28,31 +28,63 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
 
+import threading
+
+from luxon import g
 from luxon import db
 from luxon.utils.sql import build_where, build_like
+from luxon.utils.timezone import now
 
+from infinitystone.helpers.cache import (cache_store,
+                                         cache_load,
+                                         get_generation,
+                                         bump_generation)
+from infinitystone.helpers.tenants import get_tenant_forest
+from infinitystone.helpers.sql import insert_rows
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def roles_changed():
+    """Invalidate role catalog in all processes."""
+    bump_generation('roles')
+
+
+def get_role_catalog():
+    """Return role catalog as dict of role id to name.
+
+    Cached in process until roles are changed by any worker.
+    """
+    global _catalog
+
+    generation = get_generation('roles')
+    with _catalog_lock:
+        if _catalog is not None and _catalog[0] == generation:
+            return _catalog[1]
 
-def get_all_roles():
     with db() as conn:
-        roles = []
-        sql = 'SELECT name FROM infinitystone_role'
+        sql = 'SELECT id, name FROM infinitystone_role'
         result = conn.execute(sql).fetchall()
-        for role in result:
-            roles.append(role['name'])
-        return roles
+
+    catalog = {role['id']: role['name'] for role in result}
+    with _catalog_lock:
+        _catalog = (generation, catalog,)
+
+    return catalog
+
+
+def get_all_roles():
+    return list(get_role_catalog().values())
 
 
 def get_role_id(role):
-    with db() as conn:
-        sql = 'SELECT id FROM infinitystone_role'
-        sql += ' WHERE'
-        sql += ' name = %s'
-        result = conn.execute(sql,
-                              role).fetchone()
-        if result:
-            return result['id']
-        else:
-            raise ValueError('Role not found')
+    for role_id, name in get_role_catalog().items():
+        if name == role:
+            return role_id
+
+    raise ValueError('Role not found')
+
 
 def get_user_roles(user_id):
     if user_id is None:
@@ -79,32 +111,142 @@ def get_user_roles(user_id):
         return roles
 
 
-def get_context_roles(user_id, domain=None, tenant_id=None):
-    roles = []
+def user_roles_changed(user_id):
+    """Invalidate cached data derived from role assignments of user."""
+    bump_generation('user_roles:%s' % user_id)
+
+
+def get_scope_roles(user_id, domain=None, tenant_id=None):
+    """Return roles for user when scoping.
+
+    When scoping to a tenant, the domain of the tenant is used as the scope
+    domain. Returns dict with scope 'domain', 'global_roles',
+    'domain_roles' and 'tenant_roles'.
+
+    Results are cached for 'scope_cache_expire' seconds configured in the
+    '[auth]' section, until roles, role assignments of the user or the
+    tenant changes.
+    """
+    expire = g.app.config.getint('auth', 'scope_cache_expire',
+                                 fallback=600)
+    if expire <= 0:
+        return _get_scope_roles(user_id, domain, tenant_id)
+
+    key = 'scope:%s:%s:%s' % (user_id,
+                              get_generation('user_roles:%s' % user_id),
+                              get_generation('roles'),)
+    if tenant_id is not None:
+        key += ':%s:%s' % (tenant_id,
+                           get_generation('tenant:%s' % tenant_id),)
+    else:
+        key += ':%s' % domain
+
+    scope = cache_load(key)
+    if scope is None:
+        scope = _get_scope_roles(user_id, domain, tenant_id)
+        cache_store(key, scope, expire)
+
+    return scope
+
+
+def _get_scope_roles(user_id, domain=None, tenant_id=None):
+    scope = {'domain': domain,
+             'global_roles': [],
+             'domain_roles': [],
+             'tenant_roles': []}
+
+    forest = get_tenant_forest()
+    if tenant_id is not None and forest is not None:
+        # Domain of tenant from tenant forest.
+        if tenant_id not in forest:
+            scope['domain'] = None
+            return scope
+        scope['domain'] = forest.domain(tenant_id)
+
     with db() as conn:
-        values = []
-        values.append(user_id)
-        query = 'SELECT' + \
-                ' infinitystone_role.name as role' + \
-                ' FROM' + \
-                ' infinitystone_user_role LEFT JOIN infinitystone_role ON' + \
-                ' infinitystone_user_role.role_id = infinitystone_role.id' + \
-                ' where infinitystone_user_role.user_id = %s'
-        if domain is not None:
-            query += ' and infinitystone_user_role.domain = %s'
-            values.append(domain)
+        if tenant_id is not None and forest is not None:
+            query = 'SELECT' + \
+                    ' infinitystone_role.name AS role,' + \
+                    ' infinitystone_user_role.domain AS domain,' + \
+                    ' infinitystone_user_role.tenant_id AS tenant_id' + \
+                    ' FROM' + \
+                    ' infinitystone_user_role LEFT JOIN infinitystone_role' + \
+                    ' ON infinitystone_user_role.role_id =' + \
+                    ' infinitystone_role.id' + \
+                    ' WHERE infinitystone_user_role.user_id = %s' + \
+                    ' AND (infinitystone_user_role.tenant_id IS NULL' + \
+                    ' OR infinitystone_user_role.tenant_id = %s)' + \
+                    ' AND (infinitystone_user_role.domain IS NULL' + \
+                    ' OR infinitystone_user_role.domain = %s)'
+            result = conn.execute(query, (user_id, tenant_id,
+                                          scope['domain'],)).fetchall()
+        elif tenant_id is not None:
+            query = 'SELECT' + \
+                    ' infinitystone_tenant.domain AS tenant_domain,' + \
+                    ' infinitystone_role.name AS role,' + \
+                    ' infinitystone_user_role.domain AS domain,' + \
+                    ' infinitystone_user_role.tenant_id AS tenant_id' + \
+                    ' FROM infinitystone_tenant' + \
+                    ' LEFT JOIN infinitystone_user_role ON' + \
+                    ' infinitystone_user_role.user_id = %s' + \
+                    ' AND (infinitystone_user_role.tenant_id IS NULL' + \
+                    ' OR infinitystone_user_role.tenant_id =' + \
+                    ' infinitystone_tenant.id)' + \
+                    ' AND (infinitystone_user_role.domain IS NULL' + \
+                    ' OR infinitystone_user_role.domain =' + \
+                    ' infinitystone_tenant.domain)' + \
+                    ' LEFT JOIN infinitystone_role ON' + \
+                    ' infinitystone_user_role.role_id =' + \
+                    ' infinitystone_role.id' + \
+                    ' WHERE infinitystone_tenant.id = %s'
+            result = conn.execute(query, (user_id, tenant_id,)).fetchall()
+            if result:
+                scope['domain'] = result[0]['tenant_domain']
+            else:
+                scope['domain'] = None
         else:
-            query += ' and infinitystone_user_role.domain IS NULL'
+            query = 'SELECT' + \
+                    ' infinitystone_role.name AS role,' + \
+                    ' infinitystone_user_role.domain AS domain,' + \
+                    ' infinitystone_user_role.tenant_id AS tenant_id' + \
+                    ' FROM' + \
+                    ' infinitystone_user_role LEFT JOIN infinitystone_role' + \
+                    ' ON infinitystone_user_role.role_id =' + \
+                    ' infinitystone_role.id' + \
+                    ' WHERE infinitystone_user_role.user_id = %s' + \
+                    ' AND infinitystone_user_role.tenant_id IS NULL' + \
+                    ' AND (infinitystone_user_role.domain IS NULL' + \
+                    ' OR infinitystone_user_role.domain = %s)'
+            result = conn.execute(query, (user_id, domain,)).fetchall()
 
-        if tenant_id is not None:
-            query += ' and infinitystone_user_role.tenant_id = %s'
-            values.append(tenant_id)
-        else:
-            query += ' and infinitystone_user_role.tenant_id IS NULL'
+    for assignment in result:
+        if assignment['role'] is None:
+            # Tenant without any roles assigned to user.
+            continue
+
+        if assignment['tenant_id'] is None:
+            if assignment['domain'] is None:
+                scope['global_roles'].append(assignment['role'])
+            if assignment['domain'] == scope['domain']:
+                scope['domain_roles'].append(assignment['role'])
+        elif (assignment['tenant_id'] == tenant_id and
+                assignment['domain'] == scope['domain']):
+            scope['tenant_roles'].append(assignment['role'])
+
+    return scope
 
-        crsr = conn.execute(query, values)
 
-        for role in crsr:
-            roles.append(role['role'])
+def assign_roles(conn, assignments):
+    """Insert role assignments with multi-row statements.
 
-    return roles
+    Args:
+        conn: Database connection, committed by caller.
+        assignments (list): Tuples of user_id, role_id, domain and
+            tenant_id.
+    """
+    creation_time = now().strftime('%Y-%m-%d %H:%M:%S')
+    insert_rows(conn, 'infinitystone_user_role',
+                ('user_id', 'role_id', 'domain', 'tenant_id',
+                 'creation_time',),
+                [assignment + (creation_time,)
+                 for assignment in assignments])
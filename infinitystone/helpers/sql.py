@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+from uuid import uuid4
+
+from luxon import g
+
+# Rows or values per multi-row statement.
+SQL_BATCH = 500
+
+
+def ignore_conflict():
+    """Return clause leaving existing rows on unique key conflict."""
+    if g.app.config.get('database', 'type').startswith('sqlite'):
+        return ' ON CONFLICT DO NOTHING'
+    else:
+        return ' ON DUPLICATE KEY UPDATE id = id'
+
+
+def insert_rows(conn, table, fields, rows, batch=SQL_BATCH):
+    """Insert rows with multi-row statements.
+
+    Each row is given a new uuid for the 'id' field.
+
+    Args:
+        conn: Database connection, committed by caller.
+        table (str): Table name.
+        fields (tuple): Field names, excluding 'id'.
+        rows (list): Tuples of values in order of fields.
+        batch (int): Rows per statement.
+    """
+    row = '(' + ', '.join(['%s'] * (len(fields) + 1)) + ')'
+    for start in range(0, len(rows), batch):
+        chunk = rows[start:start + batch]
+        sql = 'INSERT INTO ' + table
+        sql += ' (id, ' + ', '.join(fields) + ') VALUES '
+        sql += ', '.join([row] * len(chunk))
+        values = []
+        for values_row in chunk:
+            values.append(str(uuid4()))
+            values += values_row
+        conn.execute(sql, values)
+
+
+def select_in(conn, sql, field, values, order=None, batch=SQL_BATCH):
+    """Return rows where field matches any of values.
+
+    Args:
+        conn: Database connection.
+        sql (str): Select statement without where clause.
+        field (str): Field name matched.
+        values (iterable): Values to match.
+        order (str): Optional field to order each statement by.
+        batch (int): Values per statement.
+    """
+    result = []
+    values = list(values)
+    for start in range(0, len(values), batch):
+        chunk = values[start:start + batch]
+        query = sql + ' WHERE ' + field + ' IN ('
+        query += ', '.join(['%s'] * len(chunk)) + ')'
+        if order:
+            query += ' ORDER BY ' + order
+        result += conn.execute(query, chunk).fetchall()
+
+    return result
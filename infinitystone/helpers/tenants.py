@@ -28,37 +28,373 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
 
+import threading
+from uuid import uuid4
+from time import monotonic
+
+from luxon import g
 from luxon import db
 
+from infinitystone.helpers.cache import (cache_store,
+                                         cache_load,
+                                         bump_generation,
+                                         GENERATION_EXPIRE)
+from infinitystone.helpers.sql import (ignore_conflict,
+                                       insert_rows,
+                                       select_in)
+
+# Most tenant changes applied to tenant forest before reloading it.
+FOREST_CHANGES = 256
+
+# Tenant changes kept in tenant change log.
+CHANGE_LOG = 1000
+
+_forest = None
+_forest_lock = threading.Lock()
+
+
+def tenant_changed(tenant_id):
+    """Invalidate cached data derived from tenant.
+
+    Changes are numbered in the tenant change log, tenant forests of all
+    workers apply them in order.
+    """
+    bump_generation('tenant:%s' % tenant_id)
 
-def get_tenant_domain(tenant_id):
+    change_id = str(uuid4())
     with db() as conn:
-        sql = 'SELECT domain FROM infinitystone_tenant'
+        while True:
+            # Concurrent changes taking the same number leave the row
+            # inserted first, retried with the next number.
+            seq = _last_change(conn) + 1
+            sql = 'INSERT INTO infinitystone_tenant_change'
+            sql += ' (id, seq, tenant_id)'
+            sql += ' VALUES (%s, %s, %s)'
+            sql += ignore_conflict()
+            conn.execute(sql, (change_id, seq, tenant_id,))
+            conn.commit()
+
+            sql = 'SELECT seq FROM infinitystone_tenant_change'
+            sql += ' WHERE'
+            sql += ' id = %s'
+            if conn.execute(sql, change_id).fetchone():
+                break
+
+        sql = 'DELETE FROM infinitystone_tenant_change'
         sql += ' WHERE'
-        sql += ' id = %s'
-        result = conn.execute(sql,
-                              tenant_id).fetchone()
-        if result:
-            return result['domain']
+        sql += ' seq <= %s'
+        conn.execute(sql, (seq - CHANGE_LOG,))
+        conn.commit()
+
+    # Signal workers, each change has its own key.
+    cache_store('tenants:change:%s' % seq, tenant_id, GENERATION_EXPIRE)
+
+
+def _last_change(conn):
+    sql = 'SELECT MAX(seq) AS seq FROM infinitystone_tenant_change'
+    return conn.execute(sql).fetchone()['seq'] or 0
+
+
+class TenantForest(object):
+    """Tenant hierarchy in process memory.
+
+    Maps tenant id to parent tenant, domain and sub tenants. Tenants not
+    yet known are loaded on first lookup.
+    """
+    def __init__(self):
+        self.parents = {}
+        self.domains = {}
+        self.children = {}
+        self.seq = 0
+        self.loaded = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.parents)
+
+    def __contains__(self, tenant_id):
+        if tenant_id not in self.parents:
+            self.refresh([tenant_id])
+
+        return tenant_id in self.parents
+
+    def _set(self, tenant_id, parent_id, domain):
+        self._unset(tenant_id)
+        self.parents[tenant_id] = parent_id
+        self.domains[tenant_id] = domain
+        if parent_id:
+            self.children.setdefault(parent_id, set()).add(tenant_id)
+
+    def _unset(self, tenant_id):
+        parent_id = self.parents.pop(tenant_id, None)
+        self.domains.pop(tenant_id, None)
+        if parent_id in self.children:
+            self.children[parent_id].discard(tenant_id)
+
+    def load(self):
+        """Load all tenants."""
+        with db() as conn:
+            seq = _last_change(conn)
+            sql = 'SELECT id, tenant_id, domain FROM infinitystone_tenant'
+            result = conn.execute(sql).fetchall()
+
+        parents = {}
+        domains = {}
+        children = {}
+        for tenant in result:
+            parents[tenant['id']] = tenant['tenant_id']
+            domains[tenant['id']] = tenant['domain']
+            if tenant['tenant_id']:
+                children.setdefault(tenant['tenant_id'],
+                                    set()).add(tenant['id'])
+
+        with self._lock:
+            self.parents = parents
+            self.domains = domains
+            self.children = children
+            self.seq = seq
+            self.loaded = monotonic()
+
+    def refresh(self, tenant_ids, seq=None):
+        """Reload tenants, forgetting tenants no longer found."""
+        tenant_ids = set(tenant_ids)
+        if tenant_ids:
+            with db() as conn:
+                sql = 'SELECT id, tenant_id, domain'
+                sql += ' FROM infinitystone_tenant'
+                sql += ' WHERE'
+                sql += ' id IN (%s)' % ', '.join(['%s'] * len(tenant_ids))
+                result = conn.execute(sql, list(tenant_ids)).fetchall()
+        else:
+            result = []
+
+        with self._lock:
+            for tenant in result:
+                tenant_ids.discard(tenant['id'])
+                self._set(tenant['id'], tenant['tenant_id'], tenant['domain'])
+            for tenant_id in tenant_ids:
+                self._unset(tenant_id)
+            if seq is not None:
+                self.seq = seq
+
+    def domain(self, tenant_id):
+        if tenant_id in self:
+            return self.domains.get(tenant_id)
+
+    def ancestors(self, tenant_id):
+        """Return tenant and its parent tenants nearest first."""
+        max_depth = _max_depth()
+        tenants = []
+        while (tenant_id and tenant_id not in tenants and
+               len(tenants) <= max_depth and tenant_id in self):
+            tenants.append(tenant_id)
+            tenant_id = self.parents.get(tenant_id)
+
+        return tenants
+
+    def descendants(self, tenant_id):
+        """Return tenant and its sub tenants nearest first."""
+        if tenant_id not in self:
+            return []
+
+        max_depth = _max_depth()
+        tenants = [tenant_id]
+        level = [tenant_id]
+        depth = 0
+        while level and depth < max_depth:
+            # Sub tenants are modified by refresh in other threads.
+            with self._lock:
+                level = [child
+                         for parent in level
+                         for child in sorted(self.children.get(parent, ()))
+                         if child not in tenants]
+            tenants += level
+            depth += 1
+
+        return tenants
+
+
+def _tenant_changes(seq):
+    # Tenants changed after change seq, None when incomplete.
+    with db() as conn:
+        sql = 'SELECT seq, tenant_id FROM infinitystone_tenant_change'
+        sql += ' WHERE'
+        sql += ' seq > %s'
+        sql += ' ORDER BY seq'
+        result = conn.execute(sql, (seq,)).fetchall()
+
+    if not result:
+        return [], seq
+
+    if result[0]['seq'] != seq + 1:
+        return None, None
+
+    if len(result) > FOREST_CHANGES:
+        return None, None
+
+    return [change['tenant_id'] for change in result], result[-1]['seq']
+
+
+def _forest_expire():
+    return g.app.config.getint('tenants', 'forest_expire',
+                               fallback=600)
+
+
+def get_tenant_forest():
+    """Return tenant forest of process, None when disabled.
+
+    Changed tenants are reloaded when tenants change, the forest is fully
+    reloaded every 'forest_expire' seconds in the '[tenants]' section.
+    """
+    global _forest
+
+    expire = _forest_expire()
+    if expire <= 0:
+        return None
+
+    if _forest is None:
+        with _forest_lock:
+            if _forest is None:
+                forest = TenantForest()
+                forest.load()
+                _forest = forest
+
+        return _forest
+
+    forest = _forest
+    if (forest.loaded + expire >= monotonic() and
+            not cache_load('tenants:change:%s' % (forest.seq + 1))):
+        return forest
+
+    # One thread applies changes, others use the forest as is meanwhile.
+    if _forest_lock.acquire(blocking=False):
+        try:
+            if forest.loaded + expire < monotonic():
+                forest.load()
+            else:
+                changed, seq = _tenant_changes(forest.seq)
+                if changed is None:
+                    forest.load()
+                else:
+                    forest.refresh(changed, seq)
+        finally:
+            _forest_lock.release()
+
+    return forest
 
 
 def get_sub_tenants(tenant_id):
-    tenants = []
+    """Return tenant and its parent tenants."""
+    forest = get_tenant_forest()
+    if forest is not None:
+        return forest.ancestors(tenant_id) or [tenant_id]
 
-    tenant = tenant_id
+    with db() as conn:
+        sql = 'SELECT ancestor FROM infinitystone_tenant_closure'
+        sql += ' WHERE'
+        sql += ' descendant = %s'
+        sql += ' ORDER BY depth'
+        result = conn.execute(sql,
+                              tenant_id).fetchall()
 
-    while True:
-        tenant = tenant_or_sub(tenant)
-        if tenant in tenants:
-            break
-        tenants.append(tenant)
+    if result:
+        return [tenant['ancestor'] for tenant in result]
+
+    # Tenant closure not populated.
+    return get_tenant_ancestors(tenant_id) or [tenant_id]
+
+
+def get_sub_tenants_many(tenant_ids):
+    """Return dict of tenant to tenant and its parent tenants.
+
+    Resolved from the tenant forest or one tenant closure query for all
+    tenants.
+    """
+    tenant_ids = list(set(tenant_ids))
+    forest = get_tenant_forest()
+    if forest is not None:
+        return {tenant_id: forest.ancestors(tenant_id) or [tenant_id]
+                for tenant_id in tenant_ids}
+
+    tenants = {}
+    with db() as conn:
+        for row in select_in(conn,
+                             'SELECT ancestor, descendant' +
+                             ' FROM infinitystone_tenant_closure',
+                             'descendant', tenant_ids, order='depth'):
+            tenants.setdefault(row['descendant'],
+                               []).append(row['ancestor'])
 
-    if tenant_id not in tenants:
-        tenants.append(tenant_id)
+    for tenant_id in tenant_ids:
+        if tenant_id not in tenants:
+            # Tenant closure not populated.
+            tenants[tenant_id] = (get_tenant_ancestors(tenant_id) or
+                                  [tenant_id])
 
     return tenants
 
 
+def _max_depth():
+    return g.app.config.getint('tenants', 'max_depth', fallback=32)
+
+
+def _tenant_chain(sql, tenant_id):
+    with db() as conn:
+        result = conn.execute(sql, (tenant_id, _max_depth(),)).fetchall()
+
+    tenants = []
+    for tenant in result:
+        if tenant['id'] not in tenants:
+            tenants.append(tenant['id'])
+
+    return tenants
+
+
+def get_tenant_ancestors(tenant_id):
+    """Return tenant and its parent tenants nearest first.
+
+    Resolved with one recursive query limited to 'max_depth' levels in the
+    '[tenants]' section, guarding against cycles in the hierarchy.
+    """
+    sql = 'WITH RECURSIVE ancestors (id, tenant_id, depth) AS ('
+    sql += ' SELECT id, tenant_id, 0 FROM infinitystone_tenant'
+    sql += ' WHERE id = %s'
+    sql += ' UNION ALL'
+    sql += ' SELECT t.id, t.tenant_id, a.depth + 1'
+    sql += ' FROM infinitystone_tenant t'
+    sql += ' INNER JOIN ancestors a ON t.id = a.tenant_id'
+    sql += ' WHERE a.tenant_id != a.id AND a.depth < %s)'
+    sql += ' SELECT id FROM ancestors ORDER BY depth'
+    return _tenant_chain(sql, tenant_id)
+
+
+def get_tenant_descendants(tenant_id):
+    """Return tenant and its sub tenants nearest first.
+
+    Resolved with one recursive query limited to 'max_depth' levels in the
+    '[tenants]' section, guarding against cycles in the hierarchy.
+    """
+    sql = 'WITH RECURSIVE descendants (id, depth) AS ('
+    sql += ' SELECT id, 0 FROM infinitystone_tenant'
+    sql += ' WHERE id = %s'
+    sql += ' UNION ALL'
+    sql += ' SELECT t.id, d.depth + 1'
+    sql += ' FROM infinitystone_tenant t'
+    sql += ' INNER JOIN descendants d ON t.tenant_id = d.id'
+    sql += ' WHERE t.id != d.id AND d.depth < %s)'
+    sql += ' SELECT id FROM descendants ORDER BY depth'
+    return _tenant_chain(sql, tenant_id)
+
+
+def get_tenant_subtree(tenant_id):
+    """Return tenant and all its sub tenants."""
+    forest = get_tenant_forest()
+    if forest is not None:
+        return forest.descendants(tenant_id)
+
+    return get_tenant_descendants(tenant_id)
+
+
 def tenant_or_sub(tenant_id):
     with db() as conn:
         sql = 'SELECT tenant_id FROM infinitystone_tenant'
@@ -70,3 +406,73 @@ def tenant_or_sub(tenant_id):
             return result['tenant_id']
         elif result and not result['tenant_id']:
             return tenant_id
+
+
+def _insert_closure(conn, rows):
+    insert_rows(conn, 'infinitystone_tenant_closure',
+                ('ancestor', 'descendant', 'depth',), rows)
+
+
+def closure_add(conn, tenant_id, parent_id=None):
+    """Add tenant to tenant closure below parent tenant.
+
+    Tenant closure is only read and maintained with the tenant forest
+    disabled.
+    """
+    if _forest_expire() > 0:
+        return
+
+    rows = [(tenant_id, tenant_id, 0,)]
+    if parent_id:
+        sql = 'SELECT ancestor, depth FROM infinitystone_tenant_closure'
+        sql += ' WHERE'
+        sql += ' descendant = %s'
+        ancestors = conn.execute(sql, parent_id).fetchall()
+        if ancestors:
+            for ancestor in ancestors:
+                rows.append((ancestor['ancestor'], tenant_id,
+                             ancestor['depth'] + 1,))
+        else:
+            # Parent not in tenant closure yet, created before backfill.
+            for depth, ancestor in enumerate(
+                    get_tenant_ancestors(parent_id), 1):
+                rows.append((ancestor, tenant_id, depth,))
+
+    _insert_closure(conn, rows)
+
+
+def closure_remove(conn, tenant_id):
+    """Remove tenant without sub tenants from tenant closure."""
+    if _forest_expire() > 0:
+        return
+
+    sql = 'DELETE FROM infinitystone_tenant_closure'
+    sql += ' WHERE'
+    sql += ' descendant = %s OR ancestor = %s'
+    conn.execute(sql, (tenant_id, tenant_id,))
+
+
+def rebuild_closure():
+    """Rebuild tenant closure from tenant hierarchy.
+
+    Returns number of closure rows.
+    """
+    with db() as conn:
+        sql = 'SELECT id, tenant_id FROM infinitystone_tenant'
+        parents = {tenant['id']: tenant['tenant_id']
+                   for tenant in conn.execute(sql).fetchall()}
+
+        rows = []
+        for tenant_id in parents:
+            ancestor = tenant_id
+            depth = 0
+            while ancestor and depth <= len(parents):
+                rows.append((ancestor, tenant_id, depth,))
+                ancestor = parents.get(ancestor)
+                depth += 1
+
+        conn.execute('DELETE FROM infinitystone_tenant_closure')
+        _insert_closure(conn, rows)
+        conn.commit()
+
+    return len(rows)
@@ -37,6 +37,13 @@ from infinitystone.models.users import infinitystone_user
 from luxon.helpers.api import sql_list, obj
 from luxon import constants as const
 
+from infinitystone.helpers.cache import bump_generation
+
+
+def user_changed(user_id):
+    """Invalidate cached data derived from user."""
+    bump_generation('user:%s' % user_id)
+
 
 def get_user_id(username, domain=None):
     with db() as conn:
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import threading
+
+from luxon import db
+
+from infinitystone.helpers.sql import insert_rows
+
+# Row marking tenant visibility as populated by a bulk rebuild.
+POPULATED = ('ffffffff-ffff-ffff-ffff-ffffffffffff',
+             'ffffffff-ffff-ffff-ffff-ffffffffffff',)
+
+_populated = False
+_populated_lock = threading.Lock()
+
+
+def _visible(where=''):
+    # Tenants visible through tenant role assignments, being the tenant
+    # assigned and its sub tenants within the domain of the assignment.
+    sql = 'SELECT infinitystone_user_role.user_id AS user_id,'
+    sql += ' infinitystone_tenant.id AS tenant_id'
+    sql += ' FROM infinitystone_user_role'
+    sql += ' INNER JOIN infinitystone_tenant ON'
+    sql += ' infinitystone_tenant.%s = infinitystone_user_role.tenant_id'
+    sql += ' AND (infinitystone_user_role.domain IS NULL'
+    sql += ' OR infinitystone_user_role.domain ='
+    sql += ' infinitystone_tenant.domain)'
+    sql += where
+    return (sql % 'id') + ' UNION ' + (sql % 'tenant_id')
+
+
+def _insert_visibility(conn, rows):
+    insert_rows(conn, 'infinitystone_user_tenant_visibility',
+                ('user_id', 'tenant_id',), rows)
+
+
+def refresh_user_visibility(conn, user_id):
+    """Recompute tenants visible to user after role assignments change."""
+    where = ' WHERE infinitystone_user_role.user_id = %%s'
+    result = conn.execute(_visible(where), (user_id, user_id,)).fetchall()
+
+    sql = 'DELETE FROM infinitystone_user_tenant_visibility'
+    sql += ' WHERE'
+    sql += ' user_id = %s'
+    conn.execute(sql, user_id)
+    _insert_visibility(conn, [(row['user_id'], row['tenant_id'],)
+                              for row in result])
+
+
+def forget_user_visibility(conn, user_id):
+    """Remove tenants visible to deleted user."""
+    sql = 'DELETE FROM infinitystone_user_tenant_visibility'
+    sql += ' WHERE'
+    sql += ' user_id = %s'
+    conn.execute(sql, user_id)
+
+
+def ensure_visibility():
+    """Populate tenant visibility in bulk when never populated.
+
+    Tenant visibility is empty after upgrading; the first worker listing
+    tenants rebuilds it.
+    """
+    global _populated
+
+    if _populated:
+        return
+
+    with _populated_lock:
+        if _populated:
+            return
+
+        with db() as conn:
+            sql = 'SELECT user_id FROM infinitystone_user_tenant_visibility'
+            sql += ' WHERE'
+            sql += ' user_id = %s AND tenant_id = %s'
+            populated = conn.execute(sql, POPULATED).fetchone()
+
+        if not populated:
+            check_visibility()
+
+        _populated = True
+
+
+def refresh_tenant_visibility(conn, tenant_id):
+    """Recompute users tenant is visible to after tenant changes."""
+    sql = 'SELECT DISTINCT infinitystone_user_role.user_id AS user_id'
+    sql += ' FROM infinitystone_tenant'
+    sql += ' INNER JOIN infinitystone_user_role ON'
+    sql += ' (infinitystone_user_role.tenant_id = infinitystone_tenant.id'
+    sql += ' OR infinitystone_user_role.tenant_id ='
+    sql += ' infinitystone_tenant.tenant_id)'
+    sql += ' AND (infinitystone_user_role.domain IS NULL'
+    sql += ' OR infinitystone_user_role.domain ='
+    sql += ' infinitystone_tenant.domain)'
+    sql += ' WHERE infinitystone_tenant.id = %s'
+    result = conn.execute(sql, tenant_id).fetchall()
+
+    sql = 'DELETE FROM infinitystone_user_tenant_visibility'
+    sql += ' WHERE'
+    sql += ' tenant_id = %s'
+    conn.execute(sql, tenant_id)
+    _insert_visibility(conn, [(row['user_id'], tenant_id,)
+                              for row in result])
+
+
+def check_visibility(repair=True):
+    """Compare tenant visibility with role assignments.
+
+    Returns tuple of missing and stale row counts, rebuilding tenant
+    visibility in bulk when inconsistent and repair is set.
+    """
+    with db() as conn:
+        expected = {(row['user_id'], row['tenant_id'],)
+                    for row in conn.execute(_visible()).fetchall()}
+        expected.add(POPULATED)
+        sql = 'SELECT user_id, tenant_id'
+        sql += ' FROM infinitystone_user_tenant_visibility'
+        current = {(row['user_id'], row['tenant_id'],)
+                   for row in conn.execute(sql).fetchall()}
+
+        missing = len(expected - current)
+        stale = len(current - expected)
+
+        if repair and (missing or stale):
+            conn.execute('DELETE FROM infinitystone_user_tenant_visibility')
+            _insert_visibility(conn, sorted(expected))
+            conn.commit()
+
+    return (missing, stale,)
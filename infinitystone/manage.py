@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import argparse
+
+
+def tenant_closure(args):
+    from infinitystone.helpers.tenants import rebuild_closure
+    print('Tenant closure rows: %s' % rebuild_closure())
+
+
+def tenant_visibility(args):
+    from infinitystone.helpers.visibility import check_visibility
+    missing, stale = check_visibility(repair=not args.check)
+    print('Tenant visibility missing: %s, stale: %s' % (missing, stale))
+    if args.check and (missing or stale):
+        raise SystemExit(1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Infinitystone Management')
+    parser.add_argument('--ini',
+                        default='/etc/tachyonic/infinitystone.ini',
+                        help='Configuration file')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+    closure = sub.add_parser('tenant-closure',
+                             help='Rebuild tenant closure table')
+    closure.set_defaults(func=tenant_closure)
+    visibility = sub.add_parser('tenant-visibility',
+                                help='Check and rebuild tenant visibility')
+    visibility.add_argument('--check', action='store_true',
+                            help='Only report inconsistencies')
+    visibility.set_defaults(func=tenant_visibility)
+    args = parser.parse_args(argv)
+
+    from luxon.core.handlers.wsgi import Wsgi
+    Wsgi(__name__, ini=args.ini)
+    import infinitystone.app
+
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
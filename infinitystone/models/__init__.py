@@ -2,6 +2,10 @@ from infinitystone.models.domains import infinitystone_domain
 from infinitystone.models.endpoints import infinitystone_endpoint
 from infinitystone.models.roles import infinitystone_role
 from infinitystone.models.tenants import infinitystone_tenant
+from infinitystone.models.tenant_changes import infinitystone_tenant_change
+from infinitystone.models.tenant_closure import infinitystone_tenant_closure
+from infinitystone.models.tenant_visibility import (
+    infinitystone_user_tenant_visibility)
 from infinitystone.models.users import infinitystone_user
 from infinitystone.models.user_roles import infinitystone_user_role
 from infinitystone.models.elements import infinitystone_element
@@ -5,4 +5,5 @@ import infinitystone.views.roles
 import infinitystone.views.tenants
 import infinitystone.views.users
 import infinitystone.views.elements
+import infinitystone.views.auth
 #import infinitystone.views.resources
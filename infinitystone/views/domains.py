@@ -32,6 +32,7 @@ from luxon import router
 from luxon import GetLogger
 from luxon.helpers.api import sql_list, obj
 from infinitystone.models.domains import infinitystone_domain
+from infinitystone.helpers.access import get_effective_access
 from luxon.utils import sql
 
 log = GetLogger(__name__)
@@ -57,19 +58,20 @@ class Domains(object):
     def domains(self, req, resp):
         f_domain_id = sql.Field('infinitystone_domain.id')
         f_name = sql.Field('infinitystone_domain.name')
-        f_domain = sql.Field('infinitystone_user_role.domain')
-        f_tenant_id = sql.Field('infinitystone_user_role.tenant_id')
-        f_user_id = sql.Field('infinitystone_user_role.user_id')
-        j_user_role = sql.Or(
-            sql.Group(f_domain == f_name),
-            sql.Group(sql.And(f_domain == sql.Value(None),
-                              f_tenant_id == sql.Value(None))))
-        w_user_id = f_user_id == sql.Value(req.credentials.user_id)
-        select = sql.Select('infinitystone_domain',
-                            distinct=True)
+        select = sql.Select('infinitystone_domain')
         select.fields = f_domain_id, f_name
-        select.inner_join('infinitystone_user_role', j_user_role)
-        select.where = w_user_id
+
+        # Global roles see all domains, otherwise domains with role
+        # assignments of user.
+        access = get_effective_access(req.credentials.user_id)
+        if not access.global_roles:
+            w_names = [f_name == sql.Value(name) for name in access.domains]
+            if not w_names:
+                select.where = f_name == sql.Value(None)
+            elif len(w_names) == 1:
+                select.where = w_names[0]
+            else:
+                select.where = sql.Group(sql.Or(*w_names))
 
         return sql_list(req,
                         select,
@@ -32,6 +32,7 @@ from luxon import router
 from luxon.helpers.api import sql_list, obj
 
 from infinitystone.models.roles import infinitystone_role
+from infinitystone.helpers.roles import roles_changed
 
 
 @register.resources()
@@ -59,14 +60,17 @@ class Roles(object):
     def create(self, req, resp):
         role = obj(req, infinitystone_role)
         role.commit()
+        roles_changed()
         return role
 
     def update(self, req, resp, id):
         role = obj(req, infinitystone_role, sql_id=id)
         role.commit()
+        roles_changed()
         return role
 
     def delete(self, req, resp, id):
         role = obj(req, infinitystone_role, sql_id=id)
         role.commit()
+        roles_changed()
         return role
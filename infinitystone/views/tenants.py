@@ -28,11 +28,18 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
 from luxon import register
+from luxon import db
 from luxon import router
 from luxon.helpers.api import sql_list, obj
 from luxon.utils import sql
 
 from infinitystone.models.tenants import infinitystone_tenant
+from infinitystone.helpers.tenants import (tenant_changed,
+                                           closure_add,
+                                           closure_remove)
+from infinitystone.helpers.visibility import (refresh_tenant_visibility,
+                                              ensure_visibility)
+from infinitystone.helpers.access import get_effective_access
 
 
 @register.resources()
@@ -61,75 +68,45 @@ class Tenants(object):
         f_name = sql.Field('infinitystone_tenant.name')
         f_crm_id = sql.Field('infinitystone_tenant.crm_id')
         f_tenants_domain = sql.Field('infinitystone_tenant.domain')
-        f_roles_domain = sql.Field('infinitystone_user_role.domain')
         f_tenants_tenant_id = sql.Field('infinitystone_tenant.tenant_id')
-        f_roles_tenant_id = sql.Field('infinitystone_user_role.tenant_id')
-        f_user_id = sql.Field('infinitystone_user_role.user_id')
+        f_visible_tenant_id = sql.Field(
+            'infinitystone_user_tenant_visibility.tenant_id')
+        f_user_id = sql.Field('infinitystone_user_tenant_visibility.user_id')
 
         v_null = sql.Value(None)
         v_user_id = sql.Value(req.credentials.user_id)
 
-        if domain:
-            v_domain = sql.Value(domain)
-        else:
-            v_domain = sql.Value(req.context_domain)
+        if domain and domain.lower() == 'none':
+            domain = None
+        elif not domain:
+            domain = req.context_domain
 
         if tenant_id:
             v_tenant_id = sql.Value(tenant_id)
         else:
             v_tenant_id = sql.Value(req.context_tenant_id)
 
-        # Check if domain and tenant matches.
-        jg_user_role_dom_ten = sql.Group(
-            sql.And(f_roles_tenant_id == f_id,
-                    f_roles_domain == f_tenants_domain)
-        )
-        # Check if domain and sub tenant matches.
-        jg_user_role_dom_subten = sql.Group(
-            sql.And(f_roles_tenant_id == f_tenants_tenant_id,
-                    f_roles_domain == f_tenants_domain)
-        )
-        # Check if tenant is null and domain matches.
-        jg_user_role_dom = sql.Group(
-            sql.And(f_roles_tenant_id == v_null,
-                    f_roles_domain == f_tenants_domain)
-        )
-        # Check if tnenat is null and domain is null
-        jg_user_role_null = sql.Group(
-            sql.And(f_roles_tenant_id == v_null,
-                    f_roles_domain == v_null)
-        )
-        # Check if domain is null and tenant id matches.
-        jg_user_role_ten = sql.Group(
-            sql.And(f_roles_tenant_id == f_id,
-                    f_roles_domain == v_null)
-        )
-        # Check if domain is null and sub tenant id matches.
-        jg_user_role_subten = sql.Group(
-            sql.And(f_roles_tenant_id == f_tenants_tenant_id,
-                    f_roles_domain == v_null)
-        )
-
-        j_user_role = sql.Or(jg_user_role_dom_ten,
-                             jg_user_role_dom_subten,
-                             jg_user_role_dom,
-                             jg_user_role_null,
-                             jg_user_role_ten,
-                             jg_user_role_subten)
-
-        select = sql.Select('infinitystone_tenant', distinct=True)
+        select = sql.Select('infinitystone_tenant')
         select.fields = (f_id,
                          f_name,
                          f_crm_id,
                          f_tenants_domain,
                          f_tenants_tenant_id,)
-        select.inner_join('infinitystone_user_role', j_user_role)
-        select.where = f_user_id == v_user_id
 
-        if domain and domain.lower() == 'none':
+        # Global roles and roles in domain see all tenants in domain,
+        # otherwise only tenants visible through tenant roles.
+        access = get_effective_access(req.credentials.user_id)
+        if not access.global_roles and (
+                domain is None or domain not in access.domain_roles):
+            ensure_visibility()
+            select.inner_join('infinitystone_user_tenant_visibility',
+                              f_visible_tenant_id == f_id)
+            select.where = f_user_id == v_user_id
+
+        if domain is None:
             select.where = f_tenants_domain == v_null
         else:
-            select.where = f_tenants_domain == v_domain
+            select.where = f_tenants_domain == sql.Value(domain)
 
         select.where = sql.Group(
             sql.Or(f_id == v_tenant_id,
@@ -151,14 +128,28 @@ class Tenants(object):
     def create(self, req, resp):
         tenant = obj(req, infinitystone_tenant)
         tenant.commit()
+        with db() as conn:
+            closure_add(conn, tenant['id'], tenant['tenant_id'])
+            refresh_tenant_visibility(conn, tenant['id'])
+            conn.commit()
+        tenant_changed(tenant['id'])
         return tenant
 
     def update(self, req, resp, id):
         tenant = obj(req, infinitystone_tenant, sql_id=id)
         tenant.commit()
+        with db() as conn:
+            refresh_tenant_visibility(conn, id)
+            conn.commit()
+        tenant_changed(id)
         return tenant
 
     def delete(self, req, resp, id):
         tenant = obj(req, infinitystone_tenant, sql_id=id)
         tenant.commit()
+        with db() as conn:
+            closure_remove(conn, id)
+            refresh_tenant_visibility(conn, id)
+            conn.commit()
+        tenant_changed(id)
         return tenant
@@ -27,18 +27,26 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
+from hashlib import sha256
+
 from luxon import g
 from luxon import db
 from luxon import register
 from luxon import router
-from luxon.utils.imports import get_class
 from luxon.exceptions import HTTPForbidden
+from luxon.exceptions import AccessDeniedError
 from luxon.utils.timezone import to_utc
 
-from infinitystone.helpers.auth import localize, user_tenant
+from infinitystone.helpers.auth import localize, login_context, is_local
 from infinitystone.helpers.users import get_user_id
-from infinitystone.helpers.roles import get_context_roles
-from infinitystone.helpers.tenants import get_tenant_domain
+from infinitystone.helpers.roles import get_scope_roles
+from infinitystone.helpers.cache import (cache_store,
+                                         cache_load,
+                                         get_generation)
+from infinitystone.helpers.drivers import authenticate
+from infinitystone.helpers.failures import (check_failures,
+                                            record_failure,
+                                            clear_failures)
 
 
 @register.resources()
@@ -56,6 +64,8 @@ class Token(object):
         router.add('POST', '/v1/token', self.post)
         router.add('PUT', '/v1/token', self.put)
         router.add('PATCH', '/v1/token', self.patch)
+        router.add('POST', '/v1/tokens/validate', self.validate,
+                   tag='login')
 
     def get(self, req, resp):
         return req.credentials
@@ -63,51 +73,62 @@ class Token(object):
     def put(self, req, resp):
         username = req.credentials.username
         domain = req.credentials.user_domain
-        user_id = get_user_id(username, domain)
-        with db() as conn:
-            sql = "SELECT username, creation_time FROM infinitystone_user"
-            sql += " WHERE id = %s AND enabled = '1'"
-            user = conn.execute(sql, user_id).fetchone()
-        if user:
-            if user['creation_time'] > to_utc(
-                    req.credentials._credentials['loginat']):
+        loginat = req.credentials._credentials['loginat']
+
+        # Users recently found enabled and localized for this login are
+        # not checked again, unless the user changed since.
+        liveness = 'liveness:' + sha256(('%s\0%s\0%s' % (
+            username, domain, loginat,)).encode('utf-8')).hexdigest()
+        live = cache_load(liveness)
+        if (live is None or live['generation'] != get_generation(
+                'user:%s' % live['user_id'])):
+            user_id = get_user_id(username, domain)
+            generation = get_generation('user:%s' % user_id)
+            with db() as conn:
+                sql = "SELECT username, creation_time FROM infinitystone_user"
+                sql += " WHERE id = %s AND enabled = '1'"
+                user = conn.execute(sql, user_id).fetchone()
+            if not user:
+                raise HTTPForbidden('User account suspended or invalid')
+            if user['creation_time'] > to_utc(loginat):
                 raise HTTPForbidden('User account suspended or invalid')
             localize(username, domain, req.credentials.user_region,
                      req.credentials.user_confederation, user_id)
-            req.credentials.extend()
-            return req.credentials
-        else:
-            raise HTTPForbidden('User account suspended or invalid')
+
+            expire = g.app.config.getint('auth', 'liveness_expire',
+                                         fallback=30)
+            if expire > 0:
+                cache_store(liveness, {'user_id': user_id,
+                                       'generation': generation}, expire)
+
+        req.credentials.extend()
+        return req.credentials
 
     def post(self, req, resp):
         request_object = req.json
         method = request_object.get('method', 'password')
-        driver = g.app.config.get('auth', 'driver')
-        driver = get_class(driver)()
-        if hasattr(driver, method):
-            method = getattr(driver, method)
-        else:
-            raise ValueError(
-                "'%s' authentication method not supported" % method
-            )
-
         credentials = request_object.get('credentials')
         username = request_object.get('username')
         domain = request_object.get('domain')
-        if isinstance(credentials, dict):
-            metadata = method(username, domain, credentials=credentials)
-        elif credentials is None:
+        if credentials is None:
             raise ValueError("Require 'credentials'")
-        else:
+        elif not isinstance(credentials, dict):
             raise ValueError("Invalid 'credentials' provided")
 
-        # Create User locally if not existing
-        localize(username, domain)
-        # Get User_id
-        user_id = get_user_id(username, domain)
-        # Get Roles
-        global_roles = get_context_roles(user_id, None)
-        domain_roles = get_context_roles(user_id, domain)
+        # Shed offenders before touching the authentication driver.
+        failures = check_failures(username, domain, req.remote_addr)
+        try:
+            metadata, local = authenticate(method, username, domain,
+                                           credentials)
+        except AccessDeniedError:
+            record_failure(username, domain, req.remote_addr)
+            raise
+        if failures:
+            clear_failures(username, domain)
+
+        # Create User locally if not existing and get roles.
+        context = login_context(username, domain, local=local)
+        user_id = context['user_id']
         # Set roles in token
         req.credentials.new(user_id, username=username, domain=domain,
                             region=g.app.config.get(
@@ -119,17 +140,16 @@ class Token(object):
                                 'confederation',
                                 fallback='Confederation1'),
                             metadata=metadata)
-        req.credentials.roles = domain_roles + global_roles
+        req.credentials.roles = (context['domain_roles'] +
+                                 context['global_roles'])
         if len(req.credentials.roles) == 0:
-            usr_cust_tenants = user_tenant(user_id, 'Customer')
+            usr_cust_tenants = context['customer_tenants']
             if len(usr_cust_tenants) == 1:
-                req.credentials.domain = get_tenant_domain(
-                    usr_cust_tenants[0])
+                req.credentials.domain = context['tenant_domains'][
+                    usr_cust_tenants[0]]
                 req.credentials.tenant_id = usr_cust_tenants[0]
-                req.credentials.roles = get_context_roles(
-                    user_id,
-                    req.credentials.domain,
-                    usr_cust_tenants[0])
+                req.credentials.roles = context['tenant_roles'][
+                    usr_cust_tenants[0]]
             else:
                 try:
                     req.credentials.default_tenant_id = usr_cust_tenants[0]
@@ -143,31 +163,60 @@ class Token(object):
         domain = request_object.get('domain')
         tenant_id = request_object.get('tenant_id')
         user_id = req.credentials.user_id
-        username = req.credentials.username
         if tenant_id is not None:
+            self._localize(req)
             # Its important to find tenants domain, required by Photonic.
             # Since you can select global tenants that may be within a specific
             # domain prior to scoping the domain.
-            req.credentials.domain = get_tenant_domain(tenant_id)
-
+            scope = get_scope_roles(user_id, tenant_id=tenant_id)
+            req.credentials.domain = scope['domain']
             req.credentials.tenant_id = tenant_id
-            localize(username, req.credentials.user_domain,
-                     req.credentials.user_region,
-                     req.credentials.user_confederation,
-                     user_id)
-            req.credentials.roles = get_context_roles(user_id)
-            req.credentials.roles = get_context_roles(user_id,
-                                                      req.credentials.domain)
-            req.credentials.roles = get_context_roles(user_id,
-                                                      req.credentials.domain,
-                                                      tenant_id)
+            req.credentials.roles = scope['tenant_roles']
 
         elif domain is not None:
+            self._localize(req)
+            scope = get_scope_roles(user_id, domain)
             req.credentials.domain = domain
-            localize(username, req.credentials.user_domain,
-                     req.credentials.user_region,
-                     req.credentials.user_confederation, user_id)
-            req.credentials.roles = get_context_roles(user_id)
-            req.credentials.roles = get_context_roles(user_id, domain)
+            req.credentials.roles = scope['domain_roles']
 
         return req.credentials
+
+    def _localize(self, req):
+        # Users with locally issued tokens were localized on login.
+        if not is_local(req.credentials.user_region,
+                        req.credentials.user_confederation):
+            localize(req.credentials.username,
+                     req.credentials.user_domain,
+                     req.credentials.user_region,
+                     req.credentials.user_confederation,
+                     req.credentials.user_id)
+
+    def validate(self, req, resp):
+        tokens = req.json.get('tokens')
+        if not isinstance(tokens, list):
+            raise ValueError("Require list of 'tokens'")
+
+        limit = g.app.config.getint('tokens', 'validate_limit',
+                                    fallback=1000)
+        if len(tokens) > limit:
+            raise ValueError("Maximum of %s 'tokens' per request" % limit)
+
+        results = []
+        for token in tokens:
+            credentials = type(req.credentials)()
+            try:
+                credentials.token = token
+            except (AccessDeniedError, ValueError, TypeError) as e:
+                results.append({'valid': False,
+                                'reason': str(e)})
+                continue
+
+            results.append({'valid': True,
+                            'expire': credentials._credentials.get('expire'),
+                            'user_id': credentials.user_id,
+                            'username': credentials.username,
+                            'domain': credentials.domain,
+                            'tenant_id': credentials.tenant_id,
+                            'roles': credentials.roles})
+
+        return results
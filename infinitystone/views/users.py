@@ -27,6 +27,7 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
 # THE POSSIBILITY OF SUCH DAMAGE.
+from luxon import g
 from luxon import register
 from luxon import router
 from luxon import db
@@ -41,9 +42,19 @@ from infinitystone.models.tenants import infinitystone_tenant
 from infinitystone.models.user_roles import infinitystone_user_role
 from infinitystone.helpers.roles import (get_user_roles,
                                          get_role_id,
-                                         get_all_roles)
-from infinitystone.helpers.tenants import get_sub_tenants
-from luxon.utils.password import hash
+                                         get_role_catalog,
+                                         assign_roles,
+                                         user_roles_changed)
+from infinitystone.helpers.access import get_effective_access
+from infinitystone.helpers.visibility import (refresh_user_visibility,
+                                              forget_user_visibility)
+from infinitystone.helpers.tenants import (get_sub_tenants,
+                                           get_sub_tenants_many,
+                                           get_tenant_subtree)
+from infinitystone.helpers.users import user_changed
+from infinitystone.helpers.auth import forget_localized
+from infinitystone.helpers.password import hash_password
+from infinitystone.helpers.sql import select_in, SQL_BATCH
 
 
 from luxon import GetLogger
@@ -78,6 +89,10 @@ class Users(object):
                    '/v1/access/{domain}/{tenant_id}',
                    self.access,
                    tag='users:admin')
+        router.add('POST',
+                   '/v1/access',
+                   self.access_many,
+                   tag='users:admin')
 
         router.add('GET', '/v1/user_roles', self.get_roles,
                    tag='login')
@@ -95,6 +110,11 @@ class Users(object):
                    self.set_role,
                    tag='users:admin')
 
+        router.add('POST', '/v1/user_roles', self.set_roles,
+                   tag='users:admin')
+
+        router.add('DELETE', '/v1/user_roles', self.rm_roles,
+                   tag='users:admin')
         router.add('DELETE', '/v1/user_roles/{user_id}/{role_id}',
                    self.rm_role,
                    tag='users:admin')
@@ -121,11 +141,13 @@ class Users(object):
         user = obj(req, infinitystone_user,
                    hide=('password',))
         if req.json.get('password'):
-            user['password'] = hash(req.json['password'])
+            user['password'] = hash_password(req.json['password'])
         if metadata:
             user['metadata'] = js.dumps(metadata)
 
         user.commit()
+        user_changed(user['id'])
+        forget_localized()
         return user
 
     def update(self, req, resp, id):
@@ -137,7 +159,7 @@ class Users(object):
         user = obj(req, infinitystone_user, sql_id=id,
                    hide=('password',))
         if req.json.get('password'):
-            user['password'] = hash(req.json['password'])
+            user['password'] = hash_password(req.json['password'])
         if new_metadata:
             metadata = user['metadata']
             if metadata:
@@ -151,11 +173,19 @@ class Users(object):
             user['metadata'] = js.dumps(metadata)
 
         user.commit()
+        user_changed(id)
+        forget_localized()
         return user
 
     def delete(self, req, resp, id):
         user = obj(req, infinitystone_user, sql_id=id)
         user.commit()
+        with db() as conn:
+            forget_user_visibility(conn, id)
+            conn.commit()
+        user_changed(id)
+        user_roles_changed(id)
+        forget_localized()
 
     def _get_roles(self, req, user_id=None):
         if not user_id:
@@ -177,62 +207,63 @@ class Users(object):
 
         return roles
 
-    def _access(self, user_roles, domain=None,
+    def _access(self, access, domain=None,
                 tenant_id=None):
-
-        roles = []
         # For Sub level Tenants
         if tenant_id:
             tenants = get_sub_tenants(tenant_id)
+        else:
+            tenants = ()
 
-        for user_role in user_roles:
-            role = user_role['role']
-
-            # GLOBAL ROLES
-            if (user_role['domain'] is None and
-                    user_role['tenant_id'] is None):
-                if user_role['role'] == 'Root':
-                    return get_all_roles()
-                elif user_role['role'] not in roles:
-                        roles.append(role)
-            # Domain Roles
-            if (user_role['domain'] == domain and
-                    user_role['tenant_id'] is None):
-                if user_role['role'] == 'Root':
-                    return get_all_roles()
-                elif user_role['role'] not in roles:
-                        roles.append(role)
-
-            elif domain is None and tenant_id is not None:
-                # Domain level Tenant Roles
-                if (user_role['domain'] is None and
-                        user_role['tenant_id'] in tenants):
-                    if user_role['role'] == 'Root':
-                        return get_all_roles()
-                    elif user_role['role'] not in roles:
-                            roles.append(role)
-
-            elif domain is not None and tenant_id is not None:
-                # Domain level Tenant Roles
-                if (user_role['domain'] == domain and
-                        user_role['tenant_id'] in tenants):
-                    if user_role['role'] == 'Root':
-                        return get_all_roles()
-                    elif user_role['role'] not in roles:
-                            roles.append(role)
-
-        return roles
+        return access.roles(domain, tenants)
 
     def access(self, req, resp, domain=None, tenant_id=None):
-        user_roles = self._get_roles(req)
+        access = get_effective_access(req.credentials.user_id)
         if domain == 'None':
             domain = None
 
-        roles = self._access(user_roles, domain, tenant_id)
+        roles = self._access(access, domain, tenant_id)
         for item, role in enumerate(roles):
             roles[item] = {'role': role}
         return raw_list(req, roles, sql=False, context=False)
 
+    def access_many(self, req, resp):
+        contexts = req.json.get('contexts')
+        if not isinstance(contexts, list):
+            raise ValueError("Require list of 'contexts'")
+
+        limit = g.app.config.getint('auth', 'access_limit',
+                                    fallback=1000)
+        if len(contexts) > limit:
+            raise ValueError("Maximum of %s 'contexts' per request" % limit)
+
+        for context in contexts:
+            if not isinstance(context, dict):
+                raise ValueError("Require 'contexts' as objects")
+            for field in ('domain', 'tenant_id'):
+                if not (context.get(field) is None or
+                        isinstance(context.get(field), str)):
+                    raise ValueError("Require '%s' of 'contexts' as string"
+                                     % field)
+
+        access = get_effective_access(req.credentials.user_id)
+        tenants = get_sub_tenants_many(context['tenant_id']
+                                       for context in contexts
+                                       if context.get('tenant_id'))
+
+        results = []
+        for context in contexts:
+            domain = context.get('domain')
+            if domain == 'None':
+                domain = None
+            tenant_id = context.get('tenant_id')
+            results.append({'domain': domain,
+                            'tenant_id': tenant_id,
+                            'roles': access.roles(
+                                domain, tenants.get(tenant_id, ()))})
+
+        return results
+
     def get_roles(self, req, resp, user_id=None):
         roles = self._get_roles(req, user_id)
         return raw_list(req, roles, sql=False, context=False)
@@ -243,7 +274,7 @@ class Users(object):
             domain = None
 
         role_id = get_role_id(role)
-        current_roles = self._get_roles(req)
+        current_access = get_effective_access(req.credentials.user_id)
 
         # Ensure Tenant in Domain.
         if tenant_id:
@@ -254,7 +285,7 @@ class Users(object):
             domain = tenant['domain']
 
         # Check if access to role
-        access = self._access(current_roles, domain, tenant_id)
+        access = self._access(current_access, domain, tenant_id)
 
         if role not in access:
             raise AccessDeniedError(
@@ -271,6 +302,166 @@ class Users(object):
             model['tenant_id'] = tenant_id
 
         model.commit()
+        with db() as conn:
+            refresh_user_visibility(conn, user_id)
+            conn.commit()
+        user_roles_changed(user_id)
+
+    def _in_context(self, req, domain, tenant_id):
+        # Same as validate_access for rows loaded in bulk.
+        if req.context_domain and domain != req.context_domain:
+            return False
+
+        if req.context_tenant_id:
+            if not tenant_id:
+                return False
+            if req.context_tenant_id not in get_sub_tenants(tenant_id):
+                return False
+
+        return True
+
+    def set_roles(self, req, resp):
+        assignments = req.json.get('assignments')
+        if not isinstance(assignments, list):
+            raise ValueError("Require list of 'assignments'")
+
+        limit = g.app.config.getint('auth', 'assign_limit',
+                                    fallback=1000)
+        if len(assignments) > limit:
+            raise ValueError("Maximum of %s 'assignments' per request" %
+                             limit)
+
+        current_access = get_effective_access(req.credentials.user_id)
+        role_ids = {name: role_id
+                    for role_id, name in get_role_catalog().items()}
+
+        items = []
+        invalid = []
+        for assignment in assignments:
+            if not isinstance(assignment, dict):
+                assignment = {}
+                invalid.append('Assignment not an object')
+            elif not all(assignment.get(field) is None or
+                         isinstance(assignment.get(field), str)
+                         for field in ('user_id', 'role', 'domain',
+                                       'tenant_id')):
+                invalid.append('Assignment fields must be strings')
+            else:
+                invalid.append(None)
+
+            if invalid[-1]:
+                items.append({'user_id': None,
+                              'role': None,
+                              'domain': None,
+                              'tenant_id': None})
+                continue
+
+            domain = assignment.get('domain')
+            if domain and domain.lower() == 'none':
+                domain = None
+            items.append({'user_id': assignment.get('user_id'),
+                          'role': assignment.get('role'),
+                          'domain': domain,
+                          'tenant_id': assignment.get('tenant_id')})
+
+        user_ids = {item['user_id'] for item in items if item['user_id']}
+        tenant_ids = {item['tenant_id'] for item in items
+                      if item['tenant_id']}
+        domains = {item['domain'] for item in items if item['domain']}
+
+        with db() as conn:
+            users = {user['id']: user for user in select_in(
+                conn,
+                'SELECT id FROM infinitystone_user',
+                'id', user_ids)}
+            tenants = {tenant['id']: tenant for tenant in select_in(
+                conn,
+                'SELECT id, domain FROM infinitystone_tenant',
+                'id', tenant_ids)}
+            domains = {domain['name'] for domain in select_in(
+                conn,
+                'SELECT name FROM infinitystone_domain',
+                'name', domains)}
+            existing = {(role['user_id'], role['role_id'],
+                         role['domain'], role['tenant_id'],)
+                        for role in select_in(
+                            conn,
+                            'SELECT user_id, role_id, domain, tenant_id' +
+                            ' FROM infinitystone_user_role',
+                            'user_id', users)}
+
+            access = {}
+            results = []
+            rows = []
+            for item, reason in zip(items, invalid):
+                result = dict(item)
+                results.append(result)
+
+                if reason:
+                    result['result'] = 'invalid'
+                    result['reason'] = reason
+                    continue
+
+                user = users.get(item['user_id'])
+                if user is None:
+                    result['result'] = 'invalid'
+                    result['reason'] = 'User not found'
+                    continue
+
+                if item['role'] not in role_ids:
+                    result['result'] = 'invalid'
+                    result['reason'] = 'Role not found'
+                    continue
+
+                if item['tenant_id']:
+                    tenant = tenants.get(item['tenant_id'])
+                    if tenant is None:
+                        result['result'] = 'invalid'
+                        result['reason'] = 'Tenant not found'
+                        continue
+                    # Important sanity..
+                    result['domain'] = tenant['domain']
+                    if not self._in_context(req, tenant['domain'],
+                                            tenant['id']):
+                        result['result'] = 'denied'
+                        result['reason'] = 'Tenant not in context'
+                        continue
+                elif result['domain'] and result['domain'] not in domains:
+                    result['result'] = 'invalid'
+                    result['reason'] = 'Domain not found'
+                    continue
+
+                context = (result['domain'], result['tenant_id'],)
+                if context not in access:
+                    access[context] = self._access(current_access,
+                                                   *context)
+
+                if item['role'] not in access[context]:
+                    result['result'] = 'denied'
+                    result['reason'] = ('Not sufficient credentials' +
+                                        ' to assign role')
+                    continue
+
+                row = (user['id'], role_ids[item['role']],
+                       result['domain'], result['tenant_id'],)
+                if row in existing:
+                    result['result'] = 'exists'
+                    continue
+
+                existing.add(row)
+                rows.append(row)
+                result['result'] = 'assigned'
+
+            assign_roles(conn, rows)
+            changed = {row[0] for row in rows}
+            for user_id in changed:
+                refresh_user_visibility(conn, user_id)
+            conn.commit()
+
+        for user_id in changed:
+            user_roles_changed(user_id)
+
+        return results
 
     def rm_role(self, req, resp, user_id, role_id):
         user = infinitystone_user()
@@ -282,4 +473,88 @@ class Users(object):
                                         user_id=user_id)
             sql += " WHERE %s" % where
             conn.execute(sql, values)
+            refresh_user_visibility(conn, user_id)
             conn.commit()
+        user_roles_changed(user_id)
+
+    def rm_roles(self, req, resp):
+        user_id = req.json.get('user_id')
+        role = req.json.get('role')
+        domain = req.json.get('domain')
+        tenant_id = req.json.get('tenant_id')
+
+        if not (user_id or domain or tenant_id):
+            raise ValueError("Require 'user_id', 'domain' or 'tenant_id'")
+
+        where = []
+        values = []
+        if user_id:
+            where.append('user_id = %s')
+            values.append(user_id)
+        if role:
+            where.append('role_id = %s')
+            values.append(get_role_id(role))
+        if domain and domain.lower() == 'none':
+            where.append('domain IS NULL')
+        elif domain:
+            where.append('domain = %s')
+            values.append(domain)
+
+        # Tenant and optionally all its sub tenants, in batches.
+        if not tenant_id:
+            batches = [(' AND '.join(where), values,)]
+        else:
+            if req.json.get('subtree'):
+                tenants = get_tenant_subtree(tenant_id) or [tenant_id]
+            else:
+                tenants = [tenant_id]
+
+            batches = []
+            for start in range(0, len(tenants), SQL_BATCH):
+                batch = tenants[start:start + SQL_BATCH]
+                batch_where = where + ['tenant_id IN (%s)' %
+                                       ', '.join(['%s'] * len(batch))]
+                batches.append((' AND '.join(batch_where),
+                                values + batch,))
+
+        with db() as conn:
+            users = set()
+            for batch_where, batch_values in batches:
+                sql = 'SELECT DISTINCT user_id'
+                sql += ' FROM infinitystone_user_role'
+                sql += ' WHERE ' + batch_where
+                for row in conn.execute(sql, batch_values).fetchall():
+                    users.add(row['user_id'])
+
+            # One access check per user.
+            checked = []
+            for user in select_in(
+                    conn,
+                    'SELECT id, domain, tenant_id FROM infinitystone_user',
+                    'id', users):
+                if not self._in_context(req, user['domain'],
+                                        user['tenant_id']):
+                    raise AccessDeniedError(
+                        'Not sufficient credentials to revoke roles')
+                checked.append(user['id'])
+
+            # Only assignments of users checked above are removed.
+            removed = 0
+            for start in range(0, len(checked), SQL_BATCH):
+                batch_users = checked[start:start + SQL_BATCH]
+                for batch_where, batch_values in batches:
+                    sql = 'DELETE FROM infinitystone_user_role'
+                    sql += ' WHERE ' + batch_where
+                    sql += ' AND user_id IN (%s)' % ', '.join(
+                        ['%s'] * len(batch_users))
+                    crsr = conn.execute(sql, batch_values + batch_users)
+                    removed += crsr.rowcount
+
+            for user_id in checked:
+                refresh_user_visibility(conn, user_id)
+            conn.commit()
+
+        for user_id in checked:
+            user_roles_changed(user_id)
+
+        return {'removed': removed}
@@ -34,3 +34,7 @@ application = Wsgi(__name__,
 
 # This the place to start importing luxon packages/modules.
 import infinitystone.app
+
+# Calibrate password hashing cost for this host once at startup.
+from infinitystone.helpers.password import hash_cost
+hash_cost(wait=True)
@@ -156,6 +156,9 @@ setup_dict = dict(
         'tachyonic.ui': [
             'infinitystone = infinitystone.ui.app'
         ],
+        'console_scripts': [
+            'infinitystone-manage = infinitystone.manage:main'
+        ],
     }
 
 )
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+"""Login and scoping throughput.
+
+Boots infinitystone.wsgi against a local sqlite database seeded with users,
+tenants and role assignments, then drives POST, PATCH and PUT /v1/token at
+a fixed concurrency. Reports p50/p95/p99 latency, throughput and SQL
+statements per request, saving results as JSON for comparison between
+releases.
+
+Requires the luxon command line utility to create the database and token
+signing keys.
+
+    $ python3 -m tests.benchmarks.bench_token --users 1000 --output 1.0.0.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from uuid import uuid4
+from wsgiref.util import setup_testing_defaults
+from concurrent.futures import ThreadPoolExecutor
+
+import infinitystone
+from infinitystone import metadata
+
+SETTINGS = """[application]
+name = Infinitystone
+log_level = WARNING
+log_stdout = False
+
+[auth]
+driver = infinitystone.auth:SQL
+region = Region1
+confederation = Confederation1
+
+[tokens]
+expire = 3600
+
+[cache]
+backend = luxon.core.cache:Memory
+
+[database]
+type = sqlite3
+database = %(database)s
+"""
+
+_original_connect = sqlite3.connect
+
+
+class Statements(object):
+    """Count SQL statements executed on sqlite connections."""
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def trace(self, statement):
+        keyword = statement.lstrip().split(' ', 1)[0].upper()
+        if keyword not in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+            with self._lock:
+                self.count += 1
+
+    def connect(self, *args, **kwargs):
+        conn = _original_connect(*args, **kwargs)
+        conn.set_trace_callback(self.trace)
+        return conn
+
+
+def boot(path):
+    """Setup application in path and return WSGI application."""
+    database = os.path.join(path, 'infinitystone.sqlite3')
+    ini = os.path.join(path, 'settings.ini')
+    with open(ini, 'w') as settings:
+        settings.write(SETTINGS % {'database': database})
+
+    # infinitystone.wsgi with settings of benchmark.
+    source = os.path.join(os.path.dirname(infinitystone.__file__), 'wsgi.py')
+    with open(source) as wsgi:
+        code = wsgi.read().replace('/etc/tachyonic/infinitystone.ini', ini)
+    with open(os.path.join(path, 'wsgi.py'), 'w') as wsgi:
+        wsgi.write(code)
+
+    subprocess.check_call(['luxon', '-d', path])
+    subprocess.check_call(['luxon', '-r', path])
+
+    os.chdir(path)
+    spec = importlib.util.spec_from_file_location(
+        'infinitystone.wsgi', os.path.join(path, 'wsgi.py'))
+    wsgi = importlib.util.module_from_spec(spec)
+    sys.modules['infinitystone.wsgi'] = wsgi
+    spec.loader.exec_module(wsgi)
+    return wsgi.application, database
+
+
+def seed(database, users, tenants, roles):
+    """Seed users, tenants and role assignments.
+
+    Tenants are created in chains of wholesale, reseller and customer
+    tenants. Each user is 'Customer' on one tenant and is assigned further
+    roles on other tenants.
+    """
+    from luxon.utils.password import hash
+
+    password = hash('password')
+    created = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    conn = _original_connect(database)
+    role_ids = dict(conn.execute(
+        'SELECT name, id FROM infinitystone_role').fetchall())
+
+    tenant_ids = []
+    for tenant in range(tenants):
+        tenant_id = str(uuid4())
+        # Wholesale -> reseller -> customer chains.
+        parent = tenant_ids[-1] if tenant % 3 else None
+        conn.execute('INSERT INTO infinitystone_tenant'
+                     ' (id, domain, tenant_id, name, enabled, creation_time)'
+                     ' VALUES (?, ?, ?, ?, 1, ?)',
+                     (tenant_id, 'default', parent,
+                      'bench-tenant-%s' % tenant, created,))
+        tenant_ids.append(tenant_id)
+
+    other = [role for role in role_ids
+             if role not in ('Root', 'Customer',)]
+    user_ids = []
+    for user in range(users):
+        user_id = str(uuid4())
+        conn.execute('INSERT INTO infinitystone_user'
+                     ' (id, username, password, roaming, enabled,'
+                     ' creation_time)'
+                     ' VALUES (?, ?, ?, 0, 1, ?)',
+                     (user_id, 'bench-user-%s' % user, password, created,))
+        customer = tenant_ids[user % len(tenant_ids)]
+        assignments = [(role_ids['Customer'], customer,)]
+        for role in range(roles):
+            assignments.append((role_ids[other[role % len(other)]],
+                                tenant_ids[(user + role + 1) %
+                                           len(tenant_ids)],))
+        for role_id, tenant_id in set(assignments):
+            conn.execute('INSERT INTO infinitystone_user_role'
+                         ' (id, role_id, domain, tenant_id, user_id,'
+                         ' creation_time)'
+                         ' VALUES (?, ?, ?, ?, ?, ?)',
+                         (str(uuid4()), role_id, 'default', tenant_id,
+                          user_id, created,))
+        user_ids.append((user, customer,))
+
+    conn.commit()
+    conn.close()
+    return user_ids, tenant_ids
+
+
+def call(application, method, uri, body=None, token=None):
+    environ = {'REQUEST_METHOD': method,
+               'PATH_INFO': uri,
+               'CONTENT_TYPE': 'application/json'}
+    data = json.dumps(body or {}).encode('utf-8')
+    environ['CONTENT_LENGTH'] = str(len(data))
+    environ['wsgi.input'] = io.BytesIO(data)
+    if token:
+        environ['HTTP_X_AUTH_TOKEN'] = token
+    setup_testing_defaults(environ)
+
+    status = []
+
+    def start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+
+    content = b''.join(application(environ, start_response))
+    if not status[0].startswith('2'):
+        raise Exception('%s %s: %s' % (method, uri, status[0],))
+    return json.loads(content.decode('utf-8'))
+
+
+def percentile(latencies, percent):
+    index = int(round(percent / 100.0 * (len(latencies) - 1)))
+    return latencies[index]
+
+
+def phase(name, statements, concurrency, requests, request):
+    """Run request function at concurrency and return statistics."""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        for count in range(offset, requests, concurrency):
+            start = time.perf_counter()
+            request(count)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    before = statements.count
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, offset)
+                       for offset in range(concurrency)]:
+            future.result()
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    result = {'requests': len(latencies),
+              'concurrency': concurrency,
+              'duration': round(duration, 3),
+              'throughput': round(len(latencies) / duration, 2),
+              'p50_ms': round(percentile(latencies, 50), 3),
+              'p95_ms': round(percentile(latencies, 95), 3),
+              'p99_ms': round(percentile(latencies, 99), 3),
+              'statements_per_request': round(
+                  (statements.count - before) / len(latencies), 2)}
+    print('%-6s %8s req/s  p50 %8sms  p95 %8sms  p99 %8sms  %6s sql/req' %
+          (name, result['throughput'], result['p50_ms'], result['p95_ms'],
+           result['p99_ms'], result['statements_per_request'],))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--tenants', type=int, default=300)
+    parser.add_argument('--roles', type=int, default=3,
+                        help='Additional role assignments per user')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Requests per phase')
+    parser.add_argument('--output', help='Save results as JSON')
+    args = parser.parse_args()
+
+    statements = Statements()
+    sqlite3.connect = statements.connect
+
+    path = tempfile.mkdtemp(prefix='infinitystone-bench-')
+    application, database = boot(path)
+    users, tenants = seed(database, args.users, args.tenants, args.roles)
+
+    tokens = {}
+
+    def login(count):
+        user, tenant_id = users[count % len(users)]
+        tokens[count % len(users)] = call(
+            application, 'POST', '/v1/token',
+            {'username': 'bench-user-%s' % user,
+             'credentials': {'password': 'password'}})['token']
+
+    def scope(count):
+        user, tenant_id = users[count % len(users)]
+        call(application, 'PATCH', '/v1/token',
+             {'tenant_id': tenant_id}, token=tokens[count % len(users)])
+
+    def extend(count):
+        call(application, 'PUT', '/v1/token',
+             token=tokens[count % len(users)])
+
+    # Tokens for every user prior to scoping and extending.
+    for count in range(len(users)):
+        login(count)
+
+    results = {'version': metadata.version,
+               'python': platform.python_version(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+               'users': args.users,
+               'tenants': args.tenants,
+               'roles': args.roles,
+               'phases': {}}
+    results['phases']['POST'] = phase('POST', statements, args.concurrency,
+                                      args.requests, login)
+    results['phases']['PATCH'] = phase('PATCH', statements,
+                                       args.concurrency, args.requests,
+                                       scope)
+    results['phases']['PUT'] = phase('PUT', statements, args.concurrency,
+                                     args.requests, extend)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=4)
+
+
+if __name__ == '__main__':
+    main()
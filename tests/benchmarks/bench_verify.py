@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+"""Password verification throughput.
+
+Measures logins per second verifying bcrypt hashes inline and with the
+process pool used by the SQL authentication driver, for pool sizes up to
+the number of cores available.
+
+    $ python3 -m tests.benchmarks.bench_verify --duration 10
+"""
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from luxon.utils.password import hash
+from luxon.utils.password import valid as is_valid_password
+
+from infinitystone.helpers.password import VerifyPool
+
+
+def run(valid, threads, duration, hashed):
+    deadline = time.monotonic() + duration
+
+    def login():
+        count = 0
+        while time.monotonic() < deadline:
+            assert valid('password', hashed)
+            count += 1
+        return count
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(login) for thread in range(threads)]
+        logins = sum(future.result() for future in futures)
+    return logins / (time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='Seconds per measurement')
+    parser.add_argument('--threads', type=int, default=16,
+                        help='Concurrent request threads')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(),
+                        help='Maximum pool size measured')
+    args = parser.parse_args()
+
+    hashed = hash('password')
+    print('hash: %s' % hashed[:7])
+    print('%-8s %12s' % ('workers', 'logins/sec'))
+
+    rate = run(is_valid_password, args.threads, args.duration, hashed)
+    print('%-8s %12.2f' % ('inline', rate))
+
+    for workers in range(1, args.cores + 1):
+        pool = VerifyPool(workers, queue=args.threads)
+        try:
+            rate = run(pool.valid, args.threads, args.duration, hashed)
+        finally:
+            pool.shutdown()
+        print('%-8s %12.2f' % (workers, rate))
+
+
+if __name__ == '__main__':
+    main()
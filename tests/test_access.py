@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import pytest
+
+pytest.importorskip('luxon')
+
+from infinitystone.helpers import access as access_helper
+from infinitystone.helpers.access import EffectiveAccess
+
+ALL_ROLES = ['Admin', 'Operator', 'Root', 'Support']
+
+ASSIGNMENTS = [
+    ('Operator', None, None),
+    ('Admin', 'example.com', None),
+    ('Support', 'example.com', 'parent'),
+    ('Admin', 'other.com', 'child'),
+    ('Support', None, 'parent'),
+]
+
+ANCESTORS = {
+    'parent': ['parent'],
+    'child': ['child', 'parent'],
+    'other': ['other'],
+}
+
+
+def old_access(user_roles, domain=None, tenant_id=None):
+    # Role resolution of Users._access before EffectiveAccess.
+    roles = []
+    if tenant_id:
+        tenants = ANCESTORS[tenant_id]
+
+    for user_role in user_roles:
+        role = user_role['role']
+
+        if (user_role['domain'] is None and
+                user_role['tenant_id'] is None):
+            if user_role['role'] == 'Root':
+                return list(ALL_ROLES)
+            elif user_role['role'] not in roles:
+                roles.append(role)
+        if (user_role['domain'] == domain and
+                user_role['tenant_id'] is None):
+            if user_role['role'] == 'Root':
+                return list(ALL_ROLES)
+            elif user_role['role'] not in roles:
+                roles.append(role)
+
+        elif domain is None and tenant_id is not None:
+            if (user_role['domain'] is None and
+                    user_role['tenant_id'] in tenants):
+                if user_role['role'] == 'Root':
+                    return list(ALL_ROLES)
+                elif user_role['role'] not in roles:
+                    roles.append(role)
+
+        elif domain is not None and tenant_id is not None:
+            if (user_role['domain'] == domain and
+                    user_role['tenant_id'] in tenants):
+                if user_role['role'] == 'Root':
+                    return list(ALL_ROLES)
+                elif user_role['role'] not in roles:
+                    roles.append(role)
+
+    return roles
+
+
+@pytest.fixture(autouse=True)
+def all_roles(monkeypatch):
+    monkeypatch.setattr(access_helper, 'get_all_roles',
+                        lambda: list(ALL_ROLES))
+
+
+def compare(assignments, domain, tenant_id):
+    user_roles = [{'role': role, 'domain': role_domain,
+                   'tenant_id': role_tenant_id}
+                  for role, role_domain, role_tenant_id in assignments]
+    tenants = ANCESTORS[tenant_id] if tenant_id else ()
+    expected = sorted(old_access(user_roles, domain, tenant_id))
+    assert EffectiveAccess(assignments).roles(domain, tenants) == expected
+    return expected
+
+
+def test_global_roles():
+    assert compare(ASSIGNMENTS, None, None) == ['Operator']
+
+
+def test_domain_roles():
+    assert compare(ASSIGNMENTS, 'example.com', None) == ['Admin',
+                                                         'Operator']
+    assert compare(ASSIGNMENTS, 'unknown.com', None) == ['Operator']
+
+
+def test_tenant_ancestry_roles():
+    assert compare(ASSIGNMENTS, 'example.com', 'child') == ['Admin',
+                                                            'Operator',
+                                                            'Support']
+    assert compare(ASSIGNMENTS, 'other.com', 'child') == ['Admin',
+                                                          'Operator']
+    assert compare(ASSIGNMENTS, 'other.com', 'parent') == ['Operator']
+    assert compare(ASSIGNMENTS, None, 'child') == ['Operator', 'Support']
+    assert compare(ASSIGNMENTS, 'example.com', 'other') == ['Admin',
+                                                            'Operator']
+
+
+@pytest.mark.parametrize('root', [
+    ('Root', None, None),
+    ('Root', 'example.com', None),
+    ('Root', 'example.com', 'parent'),
+])
+def test_root_roles(root):
+    assignments = ASSIGNMENTS + [root]
+    assert compare(assignments, 'example.com', 'child') == ALL_ROLES
+    assert compare(assignments, 'other.com', 'other') == (
+        ALL_ROLES if root[1] is None else ['Operator'])
+
+
+def test_domains():
+    assert EffectiveAccess(ASSIGNMENTS).domains == ['example.com',
+                                                    'other.com']
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2018-2020 Christiaan Frans Rademan <chris@fwiw.co.za>.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders nor the names of its
+#   contributors may be used to endorse or promote products derived from
+#   this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF
+# THE POSSIBILITY OF SUCH DAMAGE.
+import json
+import time
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import pytest
+from pytest import raises
+
+pytest.importorskip('luxon')
+pytest.importorskip('requests')
+
+import requests
+from luxon.exceptions import AccessDeniedError, HTTPError
+
+from infinitystone.helpers.keystone import KeystoneClient
+from infinitystone.helpers.breaker import CircuitBreaker
+
+
+class StubKeystoneHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        time.sleep(self.server.latency)
+        body = json.loads(
+            self.rfile.read(int(self.headers['Content-Length'])))
+        user = body['auth']['identity']['password']['user']
+
+        if user['password'] == 'password':
+            self.send_response(201)
+            content = json.dumps({'token': {
+                'expires_at': '2030-01-01T00:00:00.000000Z'}}).encode()
+            self.send_header('X-Subject-Token', 'token-%s' % user['name'])
+        else:
+            self.send_response(401)
+            content = b'{}'
+
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StubKeystone(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubKeystoneHandler)
+        self.connections = set()
+        self.latency = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/v3' % self.server_address[1]
+
+
+@pytest.fixture
+def keystone():
+    server = StubKeystone()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestKeystoneClient(object):
+    def test_authenticate(self, keystone):
+        client = KeystoneClient(keystone.url)
+        token, expire = client.authenticate('admin', 'password', 'default')
+        assert token == 'token-admin'
+        assert expire == '2030-01-01T00:00:00.000000Z'
+
+    def test_invalid_credentials(self, keystone):
+        client = KeystoneClient(keystone.url)
+        with raises(AccessDeniedError):
+            client.authenticate('admin', 'wrong', 'default')
+
+    def test_keep_alive(self, keystone):
+        client = KeystoneClient(keystone.url, pool_size=1)
+        for login in range(5):
+            client.authenticate('admin', 'password', 'default')
+        assert len(keystone.connections) == 1
+
+    def test_read_timeout(self, keystone):
+        keystone.latency = 0.5
+        client = KeystoneClient(keystone.url, timeout=(1, 0.1,))
+        with raises(requests.exceptions.Timeout):
+            client.authenticate('admin', 'password', 'default')
+
+
+class TestCircuitBreaker(object):
+    def test_opens_on_latency(self, keystone):
+        keystone.latency = 0.5
+        client = KeystoneClient(keystone.url, timeout=(1, 0.1,))
+        breaker = CircuitBreaker('stub', threshold=2, reset=60,
+                                 exclude=(AccessDeniedError,))
+        for attempt in range(2):
+            with raises(requests.exceptions.Timeout):
+                breaker.call(client.authenticate,
+                             'admin', 'password', 'default')
+        assert breaker.state == breaker.OPEN
+
+        start = time.monotonic()
+        with raises(HTTPError):
+            breaker.call(client.authenticate,
+                         'admin', 'password', 'default')
+        assert time.monotonic() - start < 0.1
+        assert breaker.status()['rejected'] == 1
+
+    def test_half_open_probe(self, keystone):
+        client = KeystoneClient(keystone.url, timeout=(1, 0.1,))
+        breaker = CircuitBreaker('stub', threshold=1, reset=0.2,
+                                 exclude=(AccessDeniedError,))
+        keystone.latency = 0.5
+        with raises(requests.exceptions.Timeout):
+            breaker.call(client.authenticate,
+                         'admin', 'password', 'default')
+        assert breaker.state == breaker.OPEN
+
+        keystone.latency = 0
+        time.sleep(0.3)
+        breaker.call(client.authenticate, 'admin', 'password', 'default')
+        assert breaker.state == breaker.CLOSED
+
+    def test_invalid_credentials_not_failure(self, keystone):
+        client = KeystoneClient(keystone.url)
+        breaker = CircuitBreaker('stub', threshold=1,
+                                 exclude=(AccessDeniedError,))
+        with raises(AccessDeniedError):
+            breaker.call(client.authenticate, 'admin', 'wrong', 'default')
+        assert breaker.state == breaker.CLOSED